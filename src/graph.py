@@ -4,12 +4,15 @@ from typing import Literal
 
 from dotenv import load_dotenv
 from langchain.chat_models import init_chat_model
-from langchain.messages import AnyMessage, SystemMessage, ToolMessage
+from langchain.messages import AnyMessage, SystemMessage
 from langchain.tools import tool
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 from langgraph.graph import END, START, StateGraph
 from typing_extensions import Annotated, TypedDict
 
+from src.tool_runner import arun_tool_calls
+
 
 class MessagesState(TypedDict):
     messages: Annotated[list[AnyMessage], operator.add]
@@ -71,12 +74,12 @@ tools_by_name = {tool.name: tool for tool in tools}
 model_with_tools = model.bind_tools(tools)
 
 
-def llm_call(state: dict):
+async def llm_call(state: dict):
     """LLM decides whether to call a tool or not"""
 
     return {
         "messages": [
-            model_with_tools.invoke(
+            await model_with_tools.ainvoke(
                 [
                     SystemMessage(
                         content="You are the **arithmetic orchestrator**.\n"
@@ -94,17 +97,11 @@ def llm_call(state: dict):
     }
 
 
-def tool_node(state: dict):
-    """Performs the tool call"""
+async def tool_node(state: dict, config: RunnableConfig):
+    """Performs the tool calls of the last message concurrently"""
 
-    result = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool = tools_by_name[tool_call["name"]]
-        observation = tool.invoke(tool_call["args"])
-        result.append(
-            ToolMessage(content=observation, tool_call_id=tool_call["id"])
-        )
-    return {"messages": result}
+    tool_calls = state["messages"][-1].tool_calls
+    return {"messages": await arun_tool_calls(tool_calls, tools_by_name, state, config)}
 
 
 def should_continue(state: MessagesState) -> Literal["tool_node", END]:
@@ -4,22 +4,35 @@ from typing import Annotated, Any
 
 from dotenv import load_dotenv
 from langchain.agents import create_agent
-from langchain.messages import AnyMessage, ToolMessage
+from langchain.messages import AnyMessage
 from langchain_community.utilities import GoogleSerperAPIWrapper
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 from typing_extensions import TypedDict
 
-from src.tools.commands import peek_task, respond_task, start_task
-from src.tools.e2b import e2b_read_file, e2b_write_file, python_code_executor
-from src.tools.file import edit_file_by_line, read_file, write_file
+from src.tool_runner import arun_tool_calls
+from src.tools.commands import kill_task, list_tasks, peek_task, resize_task, respond_task, start_task
+from src.tools.async_commands import kill_task_async, peek_task_async, respond_task_async, start_task_async
+from src.tools.e2b import e2b_download_file, e2b_read_file, e2b_upload_file, e2b_write_file, python_code_executor
+from src.tools.file import (
+    edit_file_by_hunks,
+    edit_file_by_line,
+    list_directory,
+    read_file,
+    write_file,
+)
 from src.tools.mind import collaborative_discussion
-from src.tools.plan import get_plans, init_planning, update_plan
+from src.tools.plan import get_plans, get_ready_steps, init_plan_graph, init_planning, make_run_plan_steps, update_plan
+from src.tools.sandbox_pool import get_sandbox_pool
 from src.tools.web import browserless_web_loader, google_search
 
 load_dotenv()
 
 search = GoogleSerperAPIWrapper()
 
+# 启动时创建沙箱池，后台预热沙箱，第一次执行代码时无需等待冷启动
+get_sandbox_pool()
+
 api_key = os.getenv("VOLCENGINE_API_KEY")
 
 model = ChatOpenAI(
@@ -57,7 +70,7 @@ model = ChatOpenAI(
 
 
 
-tools = [get_plans, init_planning, update_plan, collaborative_discussion]
+tools = [get_plans, init_planning, init_plan_graph, get_ready_steps, update_plan, collaborative_discussion]
 tools_by_name = {tool.name: tool for tool in tools}
 model_with_tools = model.bind_tools(tools)
 
@@ -66,15 +79,11 @@ class MessagesState(TypedDict):
     llm_calls: int
     
     
-def tool_node(state: dict[str, Any]):
-    """Performs the tool call"""
+async def tool_node(state: dict[str, Any], config: RunnableConfig):
+    """Performs the tool calls of the last message concurrently"""
 
-    result = []
-    for tool_call in state["messages"][-1].tool_calls:
-        tool = tools_by_name[tool_call["name"]]
-        observation = tool.invoke(tool_call["args"])
-        result.append(ToolMessage(content=observation, tool_call_id=tool_call["id"]))
-    return {"messages": result}
+    tool_calls = state["messages"][-1].tool_calls
+    return {"messages": await arun_tool_calls(tool_calls, tools_by_name, state, config)}
 
 # agent = create_agent(
 #     model=model,
@@ -87,9 +96,12 @@ def tool_node(state: dict[str, Any]):
 
 
 
+agent_tools = [get_plans, init_planning, init_plan_graph, get_ready_steps, update_plan, collaborative_discussion, read_file, list_directory, write_file, edit_file_by_line, edit_file_by_hunks, start_task, respond_task, peek_task, resize_task, kill_task, list_tasks, start_task_async, respond_task_async, peek_task_async, kill_task_async, google_search, browserless_web_loader, e2b_read_file, e2b_write_file, e2b_upload_file, e2b_download_file, python_code_executor]
+
 agent = create_agent(
     model=model,
-    tools=[get_plans, init_planning, update_plan, collaborative_discussion, read_file, write_file, edit_file_by_line, start_task, respond_task, peek_task, google_search, browserless_web_loader, e2b_read_file, e2b_write_file, python_code_executor],
+    # run_plan_steps 可以把就绪的计划步骤分派给上面的工具并行执行
+    tools=agent_tools + [make_run_plan_steps(agent_tools)],
     system_prompt="""
     你是一个专注的架构师，软件工程师，熟知系统架构搭建整体流程，对任务的规划有着清晰的认知，擅长使用现代化的技术来搭建项目，为了减少重复造轮子，你会收集项目最佳实践。你擅长分析用户的简单需求，将其实现，专注于用户需求本身，
     对于自己已有的知识，你始终保持着质疑，你会使用搜索工具去探索现代化的项目最佳实践。你不会手动安装依赖，而是使用推荐的包管理器来安装依赖确保依赖正确。
@@ -0,0 +1,169 @@
+import asyncio
+import inspect
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextvars import copy_context
+from typing import Any
+
+from langchain.messages import ToolMessage
+from langchain.tools import BaseTool, ToolRuntime
+from langchain_core.messages import ToolCall
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
+
+# 同时执行的工具调用上限（所有会话共享）
+MAX_PARALLEL_TOOL_CALLS = int(os.getenv("MAX_PARALLEL_TOOL_CALLS", "8"))
+# 单个工具调用的超时秒数，超时后返回错误 ToolMessage，不再等待该调用
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "300"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_TOOL_CALLS, thread_name_prefix="tool-call")
+# 工具名 -> ToolRuntime 参数名（None 表示不需要注入）
+_runtime_params: dict[str, str | None] = {}
+
+
+def _runtime_param(tool: BaseTool) -> str | None:
+    """返回工具函数中类型为 ToolRuntime 的参数名，没有则返回 None"""
+    if tool.name not in _runtime_params:
+        func = getattr(tool, "func", None) or getattr(tool, "coroutine", None)
+        param_name = None
+        if func is not None:
+            for name, param in inspect.signature(func).parameters.items():
+                annotation = param.annotation
+                if annotation is ToolRuntime or getattr(annotation, "__origin__", None) is ToolRuntime:
+                    param_name = name
+                    break
+        _runtime_params[tool.name] = param_name
+    return _runtime_params[tool.name]
+
+
+def build_tool_args(
+    tool: BaseTool,
+    tool_call: ToolCall,
+    state: dict[str, Any] | None,
+    config: RunnableConfig | None,
+) -> dict[str, Any]:
+    """
+    组装工具调用参数。自定义的 tool_node 不经过 LangGraph 的 ToolNode，
+    需要自行为声明了 ToolRuntime 参数的工具（例如计划工具）注入运行时信息。
+    """
+    args = dict(tool_call["args"])
+    runtime_param = _runtime_param(tool)
+    if runtime_param:
+        try:
+            # 在图节点中运行时，工具写入的内容会出现在 stream_mode="custom" 的流里
+            stream_writer = get_stream_writer()
+        except RuntimeError:
+            stream_writer = lambda _: None  # noqa: E731
+        args[runtime_param] = ToolRuntime(
+            state=state,
+            context=None,
+            config=config or {},
+            stream_writer=stream_writer,
+            tool_call_id=tool_call["id"],
+            store=None,
+        )
+    return args
+
+
+def error_message(tool_call: ToolCall, content: str) -> ToolMessage:
+    return ToolMessage(content=content, tool_call_id=tool_call["id"], name=tool_call["name"], status="error")
+
+
+def _unknown_tool_message(tool_call: ToolCall) -> ToolMessage:
+    return error_message(tool_call, f"错误：未知的工具 {tool_call['name']}。")
+
+
+def _timeout_message(tool_call: ToolCall, timeout: float) -> ToolMessage:
+    return error_message(
+        tool_call, f"工具 {tool_call['name']} 执行超时（超过 {timeout:g} 秒），已放弃等待结果。"
+    )
+
+
+def _exception_message(tool_call: ToolCall, e: Exception) -> ToolMessage:
+    return error_message(tool_call, f"工具 {tool_call['name']} 执行出错: {type(e).__name__}: {e}")
+
+
+def invoke_tool_call(tool: BaseTool, tool_call: ToolCall, state: dict[str, Any] | None = None,
+                     config: RunnableConfig | None = None) -> ToolMessage:
+    """同步执行单个工具调用，异常转换为 status="error" 的 ToolMessage"""
+    try:
+        observation = tool.invoke(build_tool_args(tool, tool_call, state, config), config)
+    except Exception as e:
+        return _exception_message(tool_call, e)
+    return ToolMessage(content=observation, tool_call_id=tool_call["id"], name=tool_call["name"])
+
+
+def run_tool_calls(
+    tool_calls: list[ToolCall],
+    tools_by_name: dict[str, BaseTool],
+    state: dict[str, Any] | None = None,
+    config: RunnableConfig | None = None,
+    timeout: float = TOOL_TIMEOUT_SECONDS,
+) -> list[ToolMessage]:
+    """
+    并发执行一轮中的所有工具调用，返回与 tool_calls 顺序一致的 ToolMessage 列表。
+
+    - 调用在共享的有界线程池中执行，同一轮的多个网页抓取、搜索等可以重叠等待；
+    - 每个调用从提交起最多等待 timeout 秒，超时或抛出异常都会变成 status="error" 的 ToolMessage，
+      不会中断同一轮中的其他调用；
+    - 每个调用在提交时的 contextvars 副本中运行，LangGraph / LangChain 的回调与配置照常生效。
+    """
+    futures: list[tuple[ToolCall, Future | None, float]] = []
+    for tool_call in tool_calls:
+        tool = tools_by_name.get(tool_call["name"])
+        if tool is None:
+            futures.append((tool_call, None, 0.0))
+            continue
+        context = copy_context()
+        future = _executor.submit(context.run, invoke_tool_call, tool, tool_call, state, config)
+        futures.append((tool_call, future, time.monotonic() + timeout))
+
+    messages = []
+    for tool_call, future, deadline in futures:
+        if future is None:
+            messages.append(_unknown_tool_message(tool_call))
+            continue
+        try:
+            messages.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+        except FutureTimeoutError:
+            # 线程无法被强制中止，尚未开始的调用直接取消，已开始的调用结果将被丢弃
+            future.cancel()
+            messages.append(_timeout_message(tool_call, timeout))
+    return messages
+
+
+async def _ainvoke(tool: BaseTool | None, tool_call: ToolCall, state: dict[str, Any] | None,
+                   config: RunnableConfig | None, timeout: float) -> ToolMessage:
+    if tool is None:
+        return _unknown_tool_message(tool_call)
+    try:
+        observation = await asyncio.wait_for(
+            tool.ainvoke(build_tool_args(tool, tool_call, state, config), config), timeout
+        )
+    except asyncio.TimeoutError:
+        return _timeout_message(tool_call, timeout)
+    except Exception as e:
+        return _exception_message(tool_call, e)
+    return ToolMessage(content=observation, tool_call_id=tool_call["id"], name=tool_call["name"])
+
+
+async def arun_tool_calls(
+    tool_calls: list[ToolCall],
+    tools_by_name: dict[str, BaseTool],
+    state: dict[str, Any] | None = None,
+    config: RunnableConfig | None = None,
+    timeout: float = TOOL_TIMEOUT_SECONDS,
+) -> list[ToolMessage]:
+    """
+    run_tool_calls 的异步版本，供异步图节点在事件循环中使用。
+
+    提供了原生协程的工具（模型讨论、搜索等）直接在事件循环上等待 I/O，
+    其余同步工具由 BaseTool.ainvoke 放到线程池执行，不会阻塞事件循环。
+    超时的调用会被取消，错误处理与返回顺序和 run_tool_calls 相同。
+    """
+    return list(await asyncio.gather(*(
+        _ainvoke(tools_by_name.get(tool_call["name"]), tool_call, state, config, timeout)
+        for tool_call in tool_calls
+    )))
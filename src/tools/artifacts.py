@@ -0,0 +1,92 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 代码执行产生的富结果（图像、表格等）保存的目录
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")
+# 结果中的文本表示内联到工具输出时保留的最大字符数
+_MAX_INLINE_TEXT = 2000
+
+# 富结果格式 -> (文件扩展名, 内容是否为 base64)，与 e2b_code_interpreter 的 Result 属性对应
+RESULT_FORMATS: dict[str, tuple[str, bool]] = {
+    "png": (".png", True),
+    "jpeg": (".jpg", True),
+    "pdf": (".pdf", True),
+    "svg": (".svg", False),
+    "html": (".html", False),
+    "markdown": (".md", False),
+    "latex": (".tex", False),
+    "json": (".json", False),
+    "javascript": (".js", False),
+    "data": (".json", False),
+}
+
+
+class ArtifactStore:
+    """
+    按内容寻址的产物存储：文件名是内容的 sha256，相同内容只保存一份，
+    不同会话同时写入也不会互相覆盖。文件按哈希前两位分目录存放。
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR):
+        self.root = root
+
+    def path(self, artifact_id: str, extension: str) -> str:
+        return os.path.join(self.root, artifact_id[:2], artifact_id + extension)
+
+    def put(self, data: bytes, extension: str) -> str:
+        """保存内容并返回产物 ID（sha256），已存在时直接返回"""
+        artifact_id = hashlib.sha256(data).hexdigest()
+        path = self.path(artifact_id, extension)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # 先写临时文件再原子替换，读者不会看到写了一半的文件
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return artifact_id
+
+
+def _encode(value: Any, is_base64: bool) -> bytes:
+    if is_base64:
+        return base64.b64decode(value)
+    if isinstance(value, str):
+        return value.encode("utf-8")
+    return json.dumps(value, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+def store_results(results: list, store: ArtifactStore | None = None) -> list[str]:
+    """
+    把执行结果中的所有富结果保存为产物，返回给模型看的描述行（格式、产物 ID、大小、路径）。
+    结果的纯文本表示（例如最后一个表达式的值）直接内联，过长时截断。
+    """
+    store = store or _store
+    lines = []
+    for index, result in enumerate(results, start=1):
+        for name, (extension, is_base64) in RESULT_FORMATS.items():
+            value = getattr(result, name, None)
+            if value is None:
+                continue
+            data = _encode(value, is_base64)
+            artifact_id = store.put(data, extension)
+            lines.append(
+                f"[结果 {index}] {name}: sha256:{artifact_id} ({len(data)} 字节) -> {store.path(artifact_id, extension)}"
+            )
+        text = getattr(result, "text", None)
+        if text:
+            if len(text) > _MAX_INLINE_TEXT:
+                text = text[:_MAX_INLINE_TEXT] + f"...（已截断，共 {len(text)} 字符）"
+            lines.append(f"[结果 {index}] text: {text}")
+    return lines
+
+
+_store = ArtifactStore()
@@ -0,0 +1,339 @@
+import asyncio
+import atexit
+import codecs
+import os
+import re
+import subprocess
+import threading
+import time
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+from langchain_core.tools import tool
+
+from .commands import (
+    CURRENT_OS,
+    DANGER_COMMANDS,
+    MAX_FINISHED_TASKS,
+    READ_CHUNK_SIZE,
+    SHELL_TYPE,
+    _WAKE_REASONS,
+    OutputBuffer,
+    TaskInfo,
+    TerminalSessionManager,
+    _compile_wait_pattern,
+    _format_output,
+    _with_limits,
+    is_dangerous_command,
+)
+
+T = TypeVar("T")
+
+
+class _AsyncProcess:
+    """
+    把 asyncio 子进程包装成 subprocess.Popen 的接口（pid / poll / wait / send_signal / stdin），
+    这样任务的状态、超时、回收和进程树结束逻辑都可以直接复用 TerminalSessionManager。
+    wait 可以在任何线程中阻塞调用，唯独不能在托管事件循环上调用。
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self._process = process
+        self.pid = process.pid
+        self.stdin = process.stdin
+        # 输出管道由托管事件循环读取和关闭
+        self.stdout = None
+        self._exited = threading.Event()
+
+    @property
+    def returncode(self) -> int | None:
+        return self._process.returncode
+
+    def poll(self) -> int | None:
+        return self._process.returncode
+
+    def wait(self, timeout: float | None = None) -> int | None:
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(str(self.pid), timeout)
+        return self._process.returncode
+
+    def send_signal(self, sig: int) -> None:
+        self._process.send_signal(sig)
+
+    async def wait_exit(self) -> None:
+        await self._process.wait()
+        self._exited.set()
+
+
+class AsyncTerminalSessionManager(TerminalSessionManager):
+    """
+    基于 asyncio 子进程的终端任务管理器。
+
+    所有任务的子进程和输出管道都托管在同一个后台事件循环上，
+    由这一个循环统一多路复用读取，不再为每个进程单独起一个阻塞的读取线程。
+    工具调用方（例如 LangGraph 的事件循环）通过 run() 把协程提交过去并 await 结果，
+    子进程的生命周期与调用方的事件循环无关。
+
+    任务元数据、运行时限、已结束任务的回收以及进程树的结束都继承自 TerminalSessionManager。
+    """
+
+    def __init__(self):
+        super().__init__()
+        # 每个任务一个条件变量，读取到新输出或进程结束时通知等待者（只在托管循环上使用）
+        self._changed: dict[str, asyncio.Condition] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="async-terminal-loop", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    async def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """在托管事件循环上执行协程，并在调用方自己的事件循环中等待结果"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        return await asyncio.wrap_future(future)
+
+    async def _pump(self, task_id: str, process: _AsyncProcess, stream: asyncio.StreamReader) -> None:
+        buffer = self.output_buffers[task_id]
+        changed = self._changed[task_id]
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while chunk := await stream.read(READ_CHUNK_SIZE):
+                buffer.feed(decoder.decode(chunk))
+                async with changed:
+                    changed.notify_all()
+            buffer.feed(decoder.decode(b"", final=True))
+        finally:
+            # 等进程退出后再关闭缓冲区，保证 closed 时退出码已经可读
+            await process.wait_exit()
+            buffer.close()
+            async with changed:
+                changed.notify_all()
+            self.finish(task_id, process)
+
+    def evict(self, task_id: str) -> None:
+        with self._lock:
+            super().evict(task_id)
+            self._changed.pop(task_id, None)
+
+    async def wait_for(
+        self,
+        task_id: str,
+        after_seq: int,
+        min_lines: int = 1,
+        pattern: re.Pattern | None = None,
+        timeout: float = 0.0,
+        stale_prompt: str = "",
+    ) -> str:
+        """OutputBuffer.wait_for 的异步版本，等待期间不占用任何线程"""
+        buffer = self.output_buffers.get(task_id)
+        changed = self._changed.get(task_id)
+        if buffer is None or changed is None:
+            # 任务在调用方等待期间已被回收，回收前输出流已经结束
+            return "closed"
+        deadline = time.monotonic() + max(0.0, timeout)
+        checked = after_seq
+        async with changed:
+            while True:
+                reason, checked = buffer.check(after_seq, min_lines, pattern, stale_prompt, checked)
+                if reason:
+                    return reason
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return "timeout"
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except TimeoutError:
+                    pass
+
+    def _missing_text(self, task_id: str) -> str:
+        summary = self.exit_summaries.get(task_id)
+        if summary:
+            return f"任务 {task_id} 已结束，输出已被回收。退出摘要：\n{summary}"
+        return f"未找到任务 {task_id}。"
+
+    def _current_status(self, task_id: str) -> str:
+        # 任务结束后可能随时被回收
+        proc = self.sessions.get(task_id)
+        return self._status(proc, self.task_info.get(task_id)) if proc else "已结束，输出已被回收"
+
+    def format_output(self, task_id: str, offset: int | None, limit: int) -> str:
+        proc, buffer = self.get_session(task_id)
+        if not proc or not buffer:
+            return self._missing_text(task_id)
+        return _format_output(
+            task_id, self._current_status(task_id), buffer,
+            offset, limit, self.read_cursors,
+        )
+
+    async def start(self, command: str, task_id: str, wait_time: float,
+                    wait_for_lines: int, wait_pattern: str | None, cpu_seconds: int | None = None,
+                    memory_mb: int | None = None, timeout_seconds: float | None = None) -> str:
+        proc = self.sessions.get(task_id)
+        if proc and proc.poll() is None:
+            return f"错误：ID 为 {task_id} 的任务已存在。"
+
+        if os.name == "nt" and (cpu_seconds or memory_mb):
+            return "错误：cpu_seconds / memory_mb 限制仅支持 Linux/macOS，请去掉这些参数后重试。"
+
+        # 同名任务已经结束时直接回收，复用这个 ID
+        if proc:
+            self.evict(task_id)
+
+        # 与 start_task 一样放到独立的会话（进程组）中，便于结束整个进程树
+        process = _AsyncProcess(await asyncio.create_subprocess_shell(
+            _with_limits(command, cpu_seconds, memory_mb),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0,
+            start_new_session=os.name != "nt",
+        ))
+        self._changed[task_id] = asyncio.Condition()
+        self.register(task_id, process, OutputBuffer(),
+                      TaskInfo(command, cpu_seconds=cpu_seconds, memory_mb=memory_mb, timeout_seconds=timeout_seconds))
+        asyncio.get_running_loop().create_task(self._pump(task_id, process, process._process.stdout))
+
+        header = f"任务 '{task_id}' 已在 {CURRENT_OS} 上异步启动。请监控输出以处理可能的交互提示。"
+        if wait_time <= 0:
+            return header
+
+        reason = await self.wait_for(task_id, 0, wait_for_lines, _compile_wait_pattern(wait_pattern), wait_time)
+        return f"{header}\n等待结果: {_WAKE_REASONS[reason]}\n{self.format_output(task_id, None, 50)}"
+
+    async def respond(self, task_id: str, response: str, wait_time: float,
+                      wait_for_lines: int, wait_pattern: str | None) -> str:
+        proc, buffer = self.get_session(task_id)
+        if not proc or not buffer or proc.returncode is not None:
+            return f"失败：任务 {task_id} 不存在或已退出。"
+
+        input_data = response if response.endswith("\n") else response + "\n"
+        # 记录发送前的位置和当前提示，只等待发送之后的新输出
+        sent_at, stale_prompt = buffer.next_seq, buffer.partial
+        try:
+            proc.stdin.write(input_data.encode("utf-8"))
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # 进程在检查之后、写入之前退出
+            return f"失败：任务 {task_id} 不存在或已退出。"
+
+        header = f"已向 {task_id} 发送输入。"
+        if wait_time <= 0:
+            return header + "请再次查看 peek_task_async 确认结果。"
+
+        reason = await self.wait_for(
+            task_id, sent_at, wait_for_lines, _compile_wait_pattern(wait_pattern), wait_time, stale_prompt
+        )
+        return f"{header}\n等待结果: {_WAKE_REASONS[reason]}\n{self.format_output(task_id, None, 50)}"
+
+    async def peek(self, task_id: str, limit: int, offset: int | None,
+                   wait_seconds: float, wait_pattern: str | None) -> str:
+        if task_id not in self.sessions:
+            return self._missing_text(task_id)
+
+        if wait_seconds > 0:
+            after = self.read_cursors.get(task_id, 0) if offset is None else max(0, offset)
+            pattern = _compile_wait_pattern(wait_pattern)
+            # 指定了 wait_pattern 时只在匹配时返回，不因为普通新输出提前返回
+            await self.wait_for(task_id, after, 0 if pattern else 1, pattern, wait_seconds)
+
+        return self.format_output(task_id, offset, limit)
+
+    async def kill_async(self, task_id: str, force: bool) -> str:
+        if task_id not in self.sessions:
+            return f"未找到任务 {task_id}。"
+        # kill 会阻塞等待进程退出，而退出状态由托管循环更新，因此放到线程中执行
+        if not await asyncio.to_thread(self.kill, task_id, force):
+            return f"任务 {task_id} 已经结束，无需终止。状态: {self._current_status(task_id)}"
+        return f"已终止任务 {task_id}。状态: {self._current_status(task_id)}"
+
+
+async_manager = AsyncTerminalSessionManager()
+atexit.register(async_manager.shutdown)
+
+
+@tool(description=f"""
+    start_task 的异步版本：在当前系统 ({CURRENT_OS}) 使用 {SHELL_TYPE} 启动一个终端命令。
+    所有异步任务由同一个事件循环统一托管，适合同时运行大量长时间任务。
+    使用本工具启动的任务，请用 respond_task_async / peek_task_async 交互和查看。
+
+    安全限制：
+    - 严禁执行破坏性指令：{', '.join(DANGER_COMMANDS)}。
+
+    参数含义与 start_task 相同:
+    - command: 要执行的完整命令。
+    - task_id: 唯一任务标识符。
+    - wait_time: 最多等待的秒数，默认 2s；有新输出、交互提示或进程结束时立即返回。
+    - wait_for_lines: 等到至少这么多行新输出再返回，默认 1。
+    - wait_pattern: 可选，等到输出匹配该正则再返回。
+    - cpu_seconds: 可选，CPU 时间上限（秒），超过后进程被系统结束（仅 Linux/macOS，对每个进程分别生效）。
+    - memory_mb: 可选，虚拟内存上限（MB），超过后内存分配失败（仅 Linux/macOS，对每个进程分别生效）。
+    - timeout_seconds: 可选，运行时长上限（秒），超时后整个进程树会被结束。
+
+    用 kill_task_async 结束任务。已结束的任务只保留最近 {MAX_FINISHED_TASKS} 个的完整输出，更早的只保留退出摘要。
+    """)
+async def start_task_async(command: str, task_id: str, wait_time: float = 2.0,
+                           wait_for_lines: int = 1, wait_pattern: str | None = None,
+                           cpu_seconds: int | None = None, memory_mb: int | None = None,
+                           timeout_seconds: float | None = None) -> str:
+    if is_dangerous_command(command):
+        return f"安全拒绝：指令 '{command}' 包含潜在危险操作，已被拦截。"
+    return await async_manager.run(
+        async_manager.start(command, task_id, wait_time, wait_for_lines, wait_pattern,
+                            cpu_seconds, memory_mb, timeout_seconds)
+    )
+
+
+@tool
+async def respond_task_async(task_id: str, response: str, wait_time: float = 1.0,
+                             wait_for_lines: int = 1, wait_pattern: str | None = None) -> str:
+    """
+    respond_task 的异步版本：向 start_task_async 启动的任务发送标准输入。
+
+    参数含义:
+    - task_id: 目标任务 ID。
+    - response: 响应内容。如果是确认操作，通常为 'y'。
+    - wait_time: 发送后最多等待的秒数，默认 1s；有新输出、交互提示或进程结束时立即返回。
+    - wait_for_lines: 等到发送后至少这么多行新输出再返回，默认 1。
+    - wait_pattern: 可选，等到输出匹配该正则再返回。
+    """
+    return await async_manager.run(
+        async_manager.respond(task_id, response, wait_time, wait_for_lines, wait_pattern)
+    )
+
+
+@tool
+async def peek_task_async(task_id: str, limit: int = 50, offset: int | None = None,
+                          wait_seconds: float = 1.0, wait_pattern: str | None = None) -> str:
+    """
+    peek_task 的异步版本：分页查看 start_task_async 启动的任务输出。
+
+    参数含义:
+    - task_id: 启动任务时定义的唯一 ID。
+    - limit: 本次返回最多输出行数，默认为 50。
+    - offset: 起始行号（从 0 开始）。不传则从上次读取的位置继续。
+    - wait_seconds: 没有新输出时最多等待的秒数，默认 1s，设为 0 可关闭等待。
+    - wait_pattern: 可选，等到输出匹配该正则再返回（仍受 wait_seconds 限制）。
+    """
+    return await async_manager.run(
+        async_manager.peek(task_id, limit, offset, wait_seconds, wait_pattern)
+    )
+
+
+@tool
+async def kill_task_async(task_id: str, force: bool = False) -> str:
+    """
+    kill_task 的异步版本：结束 start_task_async 启动的任务，连同它启动的所有子进程一起结束。
+
+    参数含义:
+    - task_id: 目标任务 ID。
+    - force: 是否立即强制结束，默认 False。
+      False 时先请求进程正常退出（SIGTERM / CTRL_BREAK），等待 3 秒仍未退出再强制结束。
+
+    结束后仍可用 peek_task_async 查看任务的剩余输出。
+    """
+    return await async_manager.run(async_manager.kill_async(task_id, force))
@@ -1,50 +1,214 @@
-import base64
-from collections.abc import Iterator
-from typing import Literal
+import hashlib
+import os
+import shlex
+import uuid
+from collections.abc import Callable, Iterator
+from typing import Literal, TypeVar
 
 from e2b.sandbox.filesystem.filesystem import WriteEntry
 from e2b_code_interpreter import Sandbox
-from langchain.tools import tool
+from langchain.tools import ToolRuntime, tool
 
-sandbox: Sandbox | None = None
+from .artifacts import store_results
+from .executors import get_executor
+from .file import format_page, page_bounds
+from .sandbox_pool import get_sandbox_pool
+from .session import DEFAULT_SESSION_ID, session_id_of
 
+# 分块传输时每块的字节数，任意时刻只有一块数据在内存中
+TRANSFER_CHUNK_SIZE = int(os.getenv("E2B_TRANSFER_CHUNK_SIZE", str(8 * 1024 * 1024)))
+# python_code_executor 允许的最长执行时间（秒）
+MAX_CODE_TIMEOUT = 600
+# 本地计算校验和时每次读取的字节数
+_HASH_CHUNK_SIZE = 1024 * 1024
 
-def get_sandbox() -> Sandbox:
-    """懒加载 sandbox，避免提前创建"""
-    global sandbox
-    if sandbox is None:  # 检查是否已关闭
-        sandbox = Sandbox.create()  # 可选：Sandbox(timeout=600) 延长存活时间
-    return sandbox
+
+def get_sandbox(session_id: str = DEFAULT_SESSION_ID) -> Sandbox:
+    """
+    从沙箱池取出会话绑定的沙箱：同一会话始终使用同一个沙箱，
+    首次使用时分配预热好的沙箱，不必等待冷启动。
+    SANDBOX_BACKEND=local 时返回接口相同的本地替身沙箱。
+    """
+    return get_sandbox_pool().acquire(session_id)
+
+
+T = TypeVar("T")
+
+
+def run_in_sandbox(session_id: str, operation: Callable[[Sandbox], T]) -> T:
+    """
+    在会话的沙箱中执行 operation。沙箱的存活期限由沙箱池在后台续租，这里不需要再调用 set_timeout，
+    执行期间沙箱也不会因闲置被回收；
+    如果操作失败且沙箱已经失效（例如被 E2B 回收），换一个新沙箱透明地重试一次。
+    """
+    pool = get_sandbox_pool()
+    with pool.use(session_id) as sbx:
+        try:
+            return operation(sbx)
+        except Exception:
+            if not pool.invalidate(session_id, sbx):
+                raise
+    with pool.use(session_id) as sbx:
+        return operation(sbx)
 
 
+def _sh_path(path: str) -> str:
+    """
+    命令统一在沙箱根目录（cwd="/"）下执行，绝对路径转成相对根目录的路径再加引号，
+    本地替身沙箱据此把路径映射到自己的根目录下。
+    """
+    return shlex.quote(path.lstrip("/") or ".")
+
+
+def _run(sbx: Sandbox, cmd: str) -> str:
+    return sbx.commands.run(cmd, cwd="/").stdout
+
+
+def _local_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_page(sbx: Sandbox, path: str, start_line: int, end_line: int | None, user: str | None) -> str:
+    """在沙箱内用 awk 截取行窗口，只有这一页内容经过网络；总行数从 stderr 返回"""
+    actual_start, actual_end = page_bounds(start_line, end_line)
+    script = f'NR >= {actual_start} && NR <= {actual_end} {{ print }} END {{ print NR > "/dev/stderr" }}'
+    result = sbx.commands.run(f"awk {shlex.quote(script)} {_sh_path(path)}", cwd="/", user=user)
+    total_lines = int(result.stderr.split()[-1])
+    lines = result.stdout.split("\n")[:-1] if result.stdout else []
+    return format_page(path, start_line, actual_start, actual_end, lines, total_lines)
+
+
+def _upload(sbx: Sandbox, local_path: str, sandbox_path: str, size: int, digest: str) -> int:
+    """
+    把本地文件分块上传到 <sandbox_path>.part/ 目录（每块以其起始偏移命名），全部到齐后在沙箱内合并并校验。
+    目录中已有的、从 0 开始连续的分块视为已上传，从其后的偏移继续；返回本次实际传输的字节数。
+    """
+    parts_dir = f"{sandbox_path}.part"
+    parts = _sh_path(parts_dir)
+    listing = _run(sbx, f"mkdir -p {parts} && find {parts} -maxdepth 1 -type f -printf '%f %s\\n'")
+    existing = dict(line.rsplit(" ", 1) for line in listing.splitlines() if line)
+
+    # 分块属于另一个版本的源文件时全部作废
+    if ".source" not in existing or sbx.files.read(f"{parts_dir}/.source") != digest:
+        _run(sbx, f"rm -rf {parts} && mkdir -p {parts}")
+        sbx.files.write(f"{parts_dir}/.source", digest)
+        existing = {}
+
+    offset = 0
+    while int(existing.get(f"{offset:015d}", 0)) > 0:
+        offset += int(existing[f"{offset:015d}"])
+    stale = [name for name in existing if name != ".source" and int(name) >= offset]
+    if stale:
+        _run(sbx, "rm -f " + " ".join(_sh_path(f"{parts_dir}/{name}") for name in stale))
+
+    sent = 0
+    with open(local_path, "rb") as f:
+        f.seek(offset)
+        while offset < size:
+            chunk = f.read(TRANSFER_CHUNK_SIZE)
+            sbx.files.write(f"{parts_dir}/{offset:015d}", chunk)
+            offset += len(chunk)
+            sent += len(chunk)
+
+    # 合并到临时文件，校验通过后原子替换目标文件；校验失败则丢弃所有分块，下次从头上传
+    tmp = _sh_path(f"{sandbox_path}.upload-tmp")
+    _run(sbx, (
+        f"find {parts} -maxdepth 1 -type f -name '[0-9]*' | sort | xargs -r cat > {tmp} && "
+        f'if [ "$(sha256sum {tmp} | cut -d" " -f1)" = {digest} ]; '
+        f"then mv -f {tmp} {_sh_path(sandbox_path)} && rm -rf {parts}; "
+        f"else rm -rf {tmp} {parts}; echo 'sha256 校验失败' >&2; exit 3; fi"
+    ))
+    return sent
+
+
+def _download(sbx: Sandbox, sandbox_path: str, local_path: str) -> tuple[int, int, str]:
+    """
+    把沙箱文件流式下载到 <local_path>.part，校验后重命名为 local_path。
+    已有的 .part 与远端文件同样长度的前缀校验和一致时，从其末尾续传；返回 (文件大小, 本次传输字节数, sha256)。
+    """
+    path = _sh_path(sandbox_path)
+    size_line, sha_line = _run(sbx, f"stat -c %s {path} && sha256sum {path}").splitlines()[:2]
+    size, digest = int(size_line), sha_line.split()[0]
+
+    partial = f"{local_path}.part"
+    os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+    offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+    if offset > size or (offset and _local_sha256(partial) != _run(
+        sbx, f"set -o pipefail; head -c {offset} {path} | sha256sum"
+    ).split()[0]):
+        offset = 0
+
+    sent = 0
+    with open(partial, "ab" if offset else "wb") as f:
+        if offset < size:
+            # 续传时先在沙箱内截出剩余部分，只传输缺少的字节
+            source, tmp = sandbox_path, None
+            if offset:
+                tmp = f"{sandbox_path}.download-{uuid.uuid4().hex}"
+                _run(sbx, f"tail -c +{offset + 1} {path} > {_sh_path(tmp)}")
+                source = tmp
+            try:
+                for chunk in sbx.files.read(source, format="stream"):
+                    f.write(chunk)
+                    sent += len(chunk)
+            finally:
+                if tmp:
+                    _run(sbx, f"rm -f {_sh_path(tmp)}")
+
+    if _local_sha256(partial) != digest:
+        os.remove(partial)
+        raise ValueError("sha256 校验失败，已删除不完整的文件，请重试")
+    os.replace(partial, local_path)
+    return size, sent, digest
 
 
 @tool
-def e2b_read_file(path: str, format: Literal["text", "bytes", "stream"] = "text", user: str | None = "user") -> str | bytearray | Iterator[bytes]:
+def e2b_read_file(
+    path: str,
+    runtime: ToolRuntime,
+    start_line: int = 1,
+    end_line: int | None = None,
+    format: Literal["text", "bytes", "stream"] = "text",
+    user: str | None = "user",
+) -> str | bytearray | Iterator[bytes]:
     """
     Read a file from E2B sandbox.
 
+    text 格式与 read_file 一样按行分页：只传输请求的行窗口，输出带行号，
+    未指定 end_line 时读取从 start_line 开始的 200 行。大文件请分页读取或用 e2b_download_file 下载到本地。
+
     Args:
-        path: 文件在 E2B Sandox 中的路径
-        format: 读取格式 ("text", "bytes", "stream")
+        path: 文件在 E2B Sandox 中的绝对路径
+        start_line: 起始行号，从 1 开始（仅 text 格式）
+        end_line: 结束行号（仅 text 格式）
+        format: 读取格式 ("text", "bytes", "stream")，bytes / stream 返回整个文件
         user: 可选用户命名
 
     Returns:
-        文件内容（text 默认返回 str）
+        文件内容（text 返回带行号的分页文本）
     """
-    sbx = get_sandbox()
-    sbx.set_timeout(600)
-
     # 调用 E2B 文件读取
     try:
-        content = sbx.files.read(path=path, format=format, user=user)
+        if format == "text":
+            if not path.startswith("/"):
+                return "错误：path 必须是绝对路径。"
+            return run_in_sandbox(
+                session_id_of(runtime), lambda sbx: _read_page(sbx, path, start_line, end_line, user)
+            )
+        content = run_in_sandbox(
+            session_id_of(runtime), lambda sbx: sbx.files.read(path=path, format=format, user=user)
+        )
     except Exception as e:
         return f"读取文件时出错: {e}"
     return content
 
 
 @tool
-def e2b_write_file(path: str, data: str, user: str | None = "user") -> str:
+def e2b_write_file(path: str, data: str, runtime: ToolRuntime, user: str | None = "user") -> str:
     """
     Write a single file to E2B sandbox.
 
@@ -56,18 +220,15 @@ def e2b_write_file(path: str, data: str, user: str | None = "user") -> str:
     Returns:
         结果信息
     """
-    sbx = get_sandbox()
-    sbx.set_timeout(600)
-
     try:
-        sbx.files.write(path=path, data=data, user=user)
+        run_in_sandbox(session_id_of(runtime), lambda sbx: sbx.files.write(path=path, data=data, user=user))
     except Exception as e:
         return f"写入文件时出错: {e}"
     return f"OK: wrote file at {path}"
 
 
 @tool
-def e2b_write_files(files: list[WriteEntry], user: str | None = "user") -> str:
+def e2b_write_files(files: list[WriteEntry], runtime: ToolRuntime, user: str | None = "user") -> str:
     """
     Write multiple files at once to E2B sandbox.
 
@@ -78,54 +239,111 @@ def e2b_write_files(files: list[WriteEntry], user: str | None = "user") -> str:
     Returns:
         结果信息
     """
-    sbx = get_sandbox()
-    sbx.set_timeout(600)
-
     # 批量写
     try:
-        sbx.files.write_files(files, user=user)
+        run_in_sandbox(session_id_of(runtime), lambda sbx: sbx.files.write_files(files, user=user))
     except Exception as e:
         return f"写入文件时出错: {e}"
     return f"OK: wrote {len(files)} files"
 
 
 @tool
-def python_code_executor(code: str) -> str:
+def e2b_upload_file(local_path: str, sandbox_path: str, runtime: ToolRuntime) -> str:
+    """
+    把本地文件分块上传到 E2B 沙箱，适合大文件（数据集等）。
+
+    - 分块传输，内存占用只有一块大小，文件内容不会进入对话上下文；
+    - 中断后再次调用相同参数会从已上传的位置继续；
+    - 上传完成后在沙箱内校验 sha256，一致才替换目标文件。
+
+    Args:
+        local_path: 本地文件路径
+        sandbox_path: 沙箱中的目标绝对路径
+
+    Returns:
+        传输结果（大小、本次传输字节数、sha256）
+    """
+    if not sandbox_path.startswith("/"):
+        return "错误：sandbox_path 必须是绝对路径。"
+    try:
+        size = os.path.getsize(local_path)
+        digest = _local_sha256(local_path)
+        sent = run_in_sandbox(
+            session_id_of(runtime), lambda sbx: _upload(sbx, local_path, sandbox_path, size, digest)
+        )
+    except Exception as e:
+        return f"上传文件时出错: {e}"
+    return f"OK: {local_path} -> {sandbox_path}，大小 {size} 字节，本次传输 {sent} 字节，sha256 {digest}"
+
+
+@tool
+def e2b_download_file(sandbox_path: str, local_path: str, runtime: ToolRuntime) -> str:
+    """
+    把 E2B 沙箱中的文件流式下载到本地，适合大文件（数据集、生成的产物等）。
+
+    - 流式写入本地文件，内存占用有界，文件内容不会进入对话上下文；
+    - 中断后再次调用相同参数会从已下载的位置继续（先校验已下载部分）；
+    - 下载完成后校验 sha256，一致才生成目标文件。
+
+    Args:
+        sandbox_path: 沙箱中的文件绝对路径
+        local_path: 本地保存路径
+
+    Returns:
+        传输结果（大小、本次传输字节数、sha256）
+    """
+    if not sandbox_path.startswith("/"):
+        return "错误：sandbox_path 必须是绝对路径。"
+    try:
+        size, sent, digest = run_in_sandbox(
+            session_id_of(runtime), lambda sbx: _download(sbx, sandbox_path, local_path)
+        )
+    except Exception as e:
+        return f"下载文件时出错: {e}"
+    return f"OK: {sandbox_path} -> {local_path}，大小 {size} 字节，本次传输 {sent} 字节，sha256 {digest}"
+
+
+@tool
+def python_code_executor(code: str, runtime: ToolRuntime, timeout: int = 30) -> str:
     """
-    在安全的云端沙箱中执行 Python 代码，并返回执行结果。
-    
+    在沙箱中执行 Python 代码，并返回执行结果。
+
+    同一对话中的多次执行共享同一个内核：之前定义的变量、导入的模块和加载的数据可以直接使用。
+    图像、表格等富结果会保存为产物并返回产物 ID 与路径；执行期间的输出会实时推送。
+
     Args:
-        code: 要执行的完整 Python 代码字符串。
-    
+        code: 要执行的 Python 代码字符串，最后一个表达式的值会作为结果返回。
+        timeout: 超时秒数，默认 30，长时间计算可以调大，最长 600。
+
     Returns:
-        执行结果（stdout + stderr）以及可能的错误信息。
+        执行结果（stdout + stderr）、产物列表以及可能的错误信息。
     """
-    sbx = get_sandbox()
-    sbx.set_timeout(600)
-    
+    timeout = max(1, min(timeout, MAX_CODE_TIMEOUT))
+
+    def stream(name: str):
+        def write(text: str) -> None:
+            runtime.stream_writer({"type": f"python_{name}", "tool_call_id": runtime.tool_call_id, "text": text})
+        return write
+
     try:
-        # 执行代码
-        execution = sbx.run_code(code, timeout=30)
-        
+        # 执行后端由 PYTHON_EXECUTOR 决定：E2B 云端沙箱或本地预启动的进程池
+        execution = get_executor().run(
+            session_id_of(runtime), code, timeout=timeout, on_stdout=stream("stdout"), on_stderr=stream("stderr")
+        )
+        logs = "\n".join(execution.logs.stdout + execution.logs.stderr)
+
         # 1. 优先处理运行时的错误
         if execution.error:
-            logs = "\n".join(execution.logs.stdout + execution.logs.stderr)
             return f"代码执行出错:\n{execution.error.name}: {execution.error.value}\n{execution.error.traceback}\n\n日志:\n{logs}"
 
-        # 2. 安全检查是否有结果（如图表）
-        if execution.results:
-            first_result = execution.results[0]
-            if first_result.png:
-                with open('chart.png', 'wb') as f:
-                    f.write(base64.b64decode(first_result.png))
-                print('✅ 图表已保存为 chart.png')
-        else:
-            print('ℹ️ 未检测到生成的图表结果。')
+        # 2. 所有富结果（图像、表格等）保存到按内容寻址的产物存储，只把引用返回给模型
+        artifacts = store_results(execution.results)
 
         # 3. 合并并返回日志
-        logs = "\n".join(execution.logs.stdout + execution.logs.stderr)
-        return f"代码执行成功！\n输出:\n{logs}" if logs.strip() else "代码执行成功，无输出。"
-    
+        output = f"代码执行成功！\n输出:\n{logs}" if logs.strip() else "代码执行成功，无输出。"
+        if artifacts:
+            output += "\n\n产物:\n" + "\n".join(artifacts)
+        return output
+
     except Exception as e:
-        # 这里的 e 就会捕获到之前的 list index out of range
         return f"处理结果时发生异常: {e}"
@@ -0,0 +1,530 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Callable
+
+from dotenv import load_dotenv
+
+if os.name != "nt":
+    import resource
+    import select
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Python 代码执行后端，可选 e2b（默认，云端隔离沙箱）或 local（本机预启动的进程池，适合短小的计算）
+PYTHON_EXECUTOR = os.getenv("PYTHON_EXECUTOR", "e2b")
+# 本地进程池中预热（尚未分配给会话）的进程数
+LOCAL_EXECUTOR_WORKERS = int(os.getenv("LOCAL_EXECUTOR_WORKERS", "4"))
+# 单次执行的 CPU 时间上限（秒）
+LOCAL_EXECUTOR_CPU_SECONDS = int(os.getenv("LOCAL_EXECUTOR_CPU_SECONDS", "10"))
+# 每个执行进程的地址空间上限（MB）
+LOCAL_EXECUTOR_MEMORY_MB = int(os.getenv("LOCAL_EXECUTOR_MEMORY_MB", "1024"))
+# 同时保留的会话内核（带状态的执行进程）数量上限，超出时回收最久未使用的
+LOCAL_EXECUTOR_MAX_KERNELS = int(os.getenv("LOCAL_EXECUTOR_MAX_KERNELS", "16"))
+# 会话内核闲置超过该秒数后被回收，变量随之丢失
+LOCAL_EXECUTOR_KERNEL_IDLE_TIMEOUT = float(os.getenv("LOCAL_EXECUTOR_KERNEL_IDLE_TIMEOUT", "900"))
+# 执行进程启动时预先导入的模块，导入失败的模块会被忽略
+LOCAL_EXECUTOR_PREIMPORT = os.getenv(
+    "LOCAL_EXECUTOR_PREIMPORT", "math,statistics,decimal,fractions,json,re,datetime,itertools,collections,numpy"
+)
+
+
+class Logs:
+    __slots__ = ("stdout", "stderr")
+
+    def __init__(self, stdout: list[str], stderr: list[str]):
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class ExecutionError:
+    __slots__ = ("name", "value", "traceback")
+
+    def __init__(self, name: str, value: str, traceback: str):
+        self.name = name
+        self.value = value
+        self.traceback = traceback
+
+
+class Result:
+    """与 e2b_code_interpreter 的 Result 结构一致的富结果，未提供的格式为 None（png / jpeg / pdf 为 base64）"""
+    __slots__ = ("text", "png", "jpeg", "pdf", "svg", "html", "markdown", "latex", "json", "javascript", "data")
+
+    def __init__(self, **formats):
+        for name in self.__slots__:
+            setattr(self, name, formats.get(name))
+
+
+class Execution:
+    """与 e2b_code_interpreter 的 Execution 结构一致的执行结果"""
+    __slots__ = ("results", "logs", "error")
+
+    def __init__(self, logs: Logs, error: ExecutionError | None, results: list[Result] | None = None):
+        self.results = results or []
+        self.logs = logs
+        self.error = error
+
+
+# 输出回调，每次收到一段新的 stdout / stderr 文本时调用
+OutputCallback = Callable[[str], None]
+
+
+class PythonExecutor(ABC):
+    """
+    在会话自己的内核中执行一段 Python 代码并返回 Execution：
+    同一会话的多次执行共享变量，不同会话互相隔离；执行期间的输出通过 on_stdout / on_stderr 实时回调。
+    """
+
+    @abstractmethod
+    def run(self, session_id: str, code: str, timeout: float,
+            on_stdout: OutputCallback | None = None, on_stderr: OutputCallback | None = None) -> Execution:
+        ...
+
+    def shutdown(self) -> None:
+        pass
+
+
+class E2BExecutor(PythonExecutor):
+    """
+    在会话绑定的 E2B 沙箱中执行，隔离性最好。
+    沙箱池保证每个会话独占一个沙箱，沙箱的默认代码上下文就是该会话的内核，不需要再单独创建上下文。
+    """
+
+    def run(self, session_id: str, code: str, timeout: float,
+            on_stdout: OutputCallback | None = None, on_stderr: OutputCallback | None = None) -> Execution:
+        from .e2b import run_in_sandbox
+
+        return run_in_sandbox(session_id, lambda sbx: sbx.run_code(
+            code,
+            timeout=timeout,
+            on_stdout=(lambda message: on_stdout(message.line)) if on_stdout else None,
+            on_stderr=(lambda message: on_stderr(message.line)) if on_stderr else None,
+        ))
+
+
+# 执行进程（内核）的主循环：从 stdin 按行读取 JSON 请求，输出片段和最终结果以 JSON 行写回 stdout。
+# 协议使用复制出来的文件描述符，0 / 1 指向 /dev/null，用户代码的 input() 和底层输出不会破坏协议。
+# 同一进程内的多次执行共享 namespace，最后一个表达式的值和 matplotlib 图像作为富结果返回。
+_WORKER = r"""
+import ast, base64, io, json, os, sys, traceback
+requests = os.fdopen(os.dup(0), "r", encoding="utf-8")
+replies = os.fdopen(os.dup(1), "w", encoding="utf-8")
+devnull = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull, 0)
+os.dup2(devnull, 1)
+for name in sys.argv[1].split(","):
+    if name:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+import resource
+
+
+def send(message):
+    replies.write(json.dumps(message) + "\n")
+    replies.flush()
+
+
+class Stream(io.TextIOBase):
+    # 按行把输出实时发给父进程，同时保留完整内容
+    encoding = "utf-8"
+
+    def __init__(self, name):
+        self.name, self.parts, self.pending = name, [], ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.parts.append(text)
+        self.pending += text
+        if "\n" in self.pending:
+            head, _, self.pending = self.pending.rpartition("\n")
+            send({"type": self.name, "text": head + "\n"})
+        return len(text)
+
+    def flush(self):
+        if self.pending:
+            send({"type": self.name, "text": self.pending})
+            self.pending = ""
+
+
+def rich(value):
+    formats = {"text": repr(value)}
+    for name, method in (("html", "_repr_html_"), ("svg", "_repr_svg_"), ("markdown", "_repr_markdown_"),
+                         ("latex", "_repr_latex_"), ("json", "_repr_json_"), ("png", "_repr_png_")):
+        if hasattr(value, method):
+            try:
+                data = getattr(value, method)()
+            except Exception:
+                continue
+            if data is not None:
+                formats[name] = base64.b64encode(data).decode() if isinstance(data, bytes) else data
+    return formats
+
+
+def figures():
+    plt = sys.modules.get("matplotlib.pyplot")
+    if plt is None:
+        return []
+    images = []
+    for number in plt.get_fignums():
+        buffer = io.BytesIO()
+        plt.figure(number).savefig(buffer, format="png")
+        images.append({"png": base64.b64encode(buffer.getvalue()).decode()})
+    plt.close("all")
+    return images
+
+
+namespace = {"__name__": "__main__"}
+for line in requests:
+    request = json.loads(line)
+    # RLIMIT_CPU 按进程累计，每次执行前把软限制设为 已用时间 + 本次额度
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + request["cpu_seconds"] + 1
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, resource.getrlimit(resource.RLIMIT_CPU)[1]))
+    stdout, stderr = Stream("stdout"), Stream("stderr")
+    sys.stdout, sys.stderr = stdout, stderr
+    error, results = None, []
+    try:
+        tree = ast.parse(request["code"], "<code>", "exec")
+        last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+        exec(compile(tree, "<code>", "exec"), namespace)
+        if last is not None:
+            value = eval(compile(ast.Expression(last.value), "<code>", "eval"), namespace)
+            if value is not None:
+                results.append(rich(value))
+        results.extend(figures())
+    except BaseException as e:
+        # 去掉执行进程主循环自身的栈帧，只保留用户代码部分
+        trace = "".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next))
+        error = {"name": type(e).__name__, "value": str(e), "traceback": trace}
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        stdout.flush()
+        stderr.flush()
+    send({"type": "done", "stdout": "".join(stdout.parts), "stderr": "".join(stderr.parts),
+          "error": error, "results": results})
+"""
+
+
+class _Worker:
+    """一个预启动、已预导入模块的 Python 执行进程"""
+
+    def __init__(self, memory_mb: int, preimport: str):
+        self.process = subprocess.Popen(
+            [sys.executable, "-c", _WORKER, preimport],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            # 没有显示设备，matplotlib 使用非交互后端
+            env={**os.environ, "MPLBACKEND": "Agg"},
+            # 独立进程组，超时时连同用户代码启动的子进程一起结束
+            start_new_session=True,
+        )
+        # 不使用 preexec_fn（多线程进程中 fork 后执行 Python 代码可能死锁），启动后由父进程设置内存上限；
+        # 用户代码在第一次请求时才发送，此时限制已经生效。prlimit 仅 Linux 提供，其他系统不限制内存
+        self._buffer = b""
+        if memory_mb and hasattr(resource, "prlimit"):
+            limit = memory_mb * 1024 * 1024
+            try:
+                resource.prlimit(self.process.pid, resource.RLIMIT_AS, (limit, limit))
+            except OSError:
+                self.kill()
+                raise
+
+    def _read_message(self, deadline: float) -> dict:
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise EOFError
+                self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return json.loads(line)
+
+    def request(self, payload: dict, timeout: float, on_output: Callable[[dict], None]) -> dict:
+        """
+        发送一个请求并等待最终回复，期间收到的输出片段交给 on_output。
+        超时抛出 TimeoutError，进程退出抛出 EOFError。
+        """
+        self.process.stdin.write((json.dumps(payload) + "\n").encode("utf-8"))
+        self.process.stdin.flush()
+
+        deadline = time.monotonic() + timeout
+        while True:
+            message = self._read_message(deadline)
+            if message["type"] == "done":
+                return message
+            on_output(message)
+
+    def kill(self) -> None:
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class _Kernel:
+    """分配给一个会话的执行进程，变量在多次执行之间保留"""
+    __slots__ = ("worker", "lock", "last_used", "in_use")
+
+    def __init__(self, worker: _Worker):
+        self.worker = worker
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        # 已取出（正在执行或等待执行）的调用数，大于 0 时不会被回收；只在持有执行器的 _lock 时修改
+        self.in_use = 0
+
+
+class LocalProcessExecutor(PythonExecutor):
+    """
+    本机进程池执行器：进程提前启动并导入常用模块，短小代码的执行不再有解释器启动和网络往返的开销。
+
+    - 会话第一次执行时从预热进程中取出一个作为该会话的内核，之后的执行共享变量，后台随即补充新的预热进程；
+    - 内核闲置超过 kernel_idle_timeout 或数量超过 max_kernels 时回收最久未使用的；
+    - CPU 时间（RLIMIT_CPU，按单次执行计）与内存（RLIMIT_AS）受限，超限的进程被系统终止；
+    - 超过 timeout 的执行直接结束整个进程组；内核因此结束时会话的变量丢失，下次执行换新内核。
+
+    代码直接在本机运行，只有资源限制没有文件系统和网络隔离，不可信代码请使用 E2B。
+    """
+
+    def __init__(
+        self,
+        workers: int = LOCAL_EXECUTOR_WORKERS,
+        cpu_seconds: int = LOCAL_EXECUTOR_CPU_SECONDS,
+        memory_mb: int = LOCAL_EXECUTOR_MEMORY_MB,
+        preimport: str = LOCAL_EXECUTOR_PREIMPORT,
+        max_kernels: int = LOCAL_EXECUTOR_MAX_KERNELS,
+        kernel_idle_timeout: float = LOCAL_EXECUTOR_KERNEL_IDLE_TIMEOUT,
+    ):
+        if os.name == "nt":
+            raise RuntimeError("本地进程池执行器依赖 POSIX 的资源限制与进程组，Windows 上请使用 PYTHON_EXECUTOR=e2b")
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.preimport = preimport
+        self.max_kernels = max_kernels
+        self.kernel_idle_timeout = kernel_idle_timeout
+        self._closed = False
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        self._kernels: OrderedDict[str, _Kernel] = OrderedDict()
+        self._lock = threading.Lock()
+        # 后台正在启动、尚未放入 _idle 的预热进程数
+        self._pending = 0
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self.memory_mb, self.preimport)
+
+    def _spawn_in_background(self) -> None:
+        # 在后台补充预热进程，当前调用不等待解释器启动和预导入
+        def spawn() -> None:
+            try:
+                if not self._closed:
+                    self._idle.put(self._spawn())
+            except Exception:
+                # 启动失败时预热进程不会到来，_take_worker 发现没有正在启动的进程时会同步启动
+                logger.exception("补充预热执行进程失败")
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+        with self._lock:
+            self._pending += 1
+        threading.Thread(target=spawn, name="executor-spawn", daemon=True).start()
+
+    def _take_worker(self, timeout: float) -> _Worker:
+        """取出一个预热进程；预热进程已用完且后台没有正在启动的进程时，在当前调用中直接启动"""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                # 分段等待，期间后台启动失败时不必等满 timeout
+                return self._idle.get(timeout=max(0.0, min(0.1, deadline - time.monotonic())))
+            except queue.Empty:
+                with self._lock:
+                    pending = self._pending
+                if not pending:
+                    return self._spawn()
+                if time.monotonic() >= deadline:
+                    raise
+
+    def _collect_evictable(self) -> list[_Kernel]:
+        """在持有 _lock 时调用：取出闲置超时以及超出数量上限的内核（已被调用取出的除外）"""
+        now = time.monotonic()
+        evicted = []
+        for session_id, kernel in list(self._kernels.items()):
+            over_limit = len(self._kernels) > self.max_kernels
+            if kernel.in_use:
+                continue
+            if over_limit or now - kernel.last_used > self.kernel_idle_timeout:
+                del self._kernels[session_id]
+                evicted.append(kernel)
+        return evicted
+
+    def _kernel(self, session_id: str, timeout: float) -> _Kernel:
+        """取出会话的内核并登记一次使用，调用方用完后需要调用 _release"""
+        with self._lock:
+            kernel = self._kernels.get(session_id)
+            if kernel is not None:
+                kernel.in_use += 1
+                self._kernels.move_to_end(session_id)
+            evicted = self._collect_evictable()
+        for old in evicted:
+            old.worker.kill()
+        if kernel is not None:
+            return kernel
+
+        worker = self._take_worker(timeout)
+        self._spawn_in_background()
+        evicted = []
+        with self._lock:
+            kernel = self._kernels.get(session_id)
+            if kernel is None:
+                kernel = self._kernels[session_id] = _Kernel(worker)
+                worker = None
+            kernel.in_use += 1
+            # 新内核排在最后，超出数量上限时回收的是最久未使用的
+            evicted = self._collect_evictable()
+        if worker is not None:
+            # 同一会话的并发调用已经分配了内核
+            worker.kill()
+        for old in evicted:
+            old.worker.kill()
+        return kernel
+
+    def _release(self, kernel: _Kernel) -> None:
+        with self._lock:
+            kernel.in_use -= 1
+            kernel.last_used = time.monotonic()
+
+    def _drop(self, session_id: str, kernel: _Kernel) -> None:
+        with self._lock:
+            if self._kernels.get(session_id) is kernel:
+                del self._kernels[session_id]
+        kernel.worker.kill()
+
+    def run(self, session_id: str, code: str, timeout: float,
+            on_stdout: OutputCallback | None = None, on_stderr: OutputCallback | None = None) -> Execution:
+        try:
+            kernel = self._kernel(session_id, timeout)
+        except queue.Empty:
+            return Execution(Logs([], []), ExecutionError("TimeoutError", f"等待 {timeout:g} 秒后仍没有空闲的执行进程", ""))
+        except OSError as e:
+            return Execution(Logs([], []), ExecutionError(type(e).__name__, f"无法启动执行进程: {e}", ""))
+
+        try:
+            return self._execute(session_id, kernel, code, timeout, on_stdout, on_stderr)
+        finally:
+            self._release(kernel)
+
+    def _execute(self, session_id: str, kernel: _Kernel, code: str, timeout: float,
+                 on_stdout: OutputCallback | None, on_stderr: OutputCallback | None) -> Execution:
+        callbacks = {"stdout": on_stdout, "stderr": on_stderr}
+
+        def on_output(message: dict) -> None:
+            callback = callbacks.get(message["type"])
+            if callback:
+                callback(message["text"])
+
+        # 同一会话的执行按顺序进行
+        with kernel.lock:
+            try:
+                reply = kernel.worker.request({"code": code, "cpu_seconds": self.cpu_seconds}, timeout, on_output)
+            except TimeoutError:
+                self._drop(session_id, kernel)
+                return Execution(Logs([], []), ExecutionError(
+                    "TimeoutError", f"执行超过 {timeout:g} 秒，已终止，会话中的变量已丢失", ""
+                ))
+            except (EOFError, OSError, ValueError):
+                # 进程已退出（ValueError：同一会话的上一次执行超时，进程已被结束、管道已关闭）；
+                # kill 会等待进程结束，之后才能拿到真实的退出状态
+                self._drop(session_id, kernel)
+                returncode = kernel.worker.process.returncode
+                reason = "超出 CPU 时间限制" if returncode == -signal.SIGXCPU else f"退出码 {returncode}，可能超出内存限制"
+                return Execution(Logs([], []), ExecutionError(
+                    "WorkerExited", f"执行进程意外退出（{reason}），会话中的变量已丢失", ""
+                ))
+
+        stdout = [reply["stdout"]] if reply["stdout"] else []
+        stderr = [reply["stderr"]] if reply["stderr"] else []
+        error = ExecutionError(**reply["error"]) if reply["error"] else None
+        return Execution(Logs(stdout, stderr), error, [Result(**formats) for formats in reply["results"]])
+
+    def shutdown(self) -> None:
+        self._closed = True
+        with self._lock:
+            kernels = list(self._kernels.values())
+            self._kernels.clear()
+        for kernel in kernels:
+            kernel.worker.kill()
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                return
+
+
+_executors: dict[str, PythonExecutor] = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name: str | None = None) -> PythonExecutor:
+    """返回全局共享的执行器，name 为空时使用环境变量 PYTHON_EXECUTOR 指定的后端"""
+    name = name or PYTHON_EXECUTOR
+    with _executors_lock:
+        if name not in _executors:
+            if name == "e2b":
+                executor = E2BExecutor()
+            elif name == "local":
+                executor = LocalProcessExecutor()
+            else:
+                raise ValueError(f"未知的 PYTHON_EXECUTOR: {name}，可选值: e2b, local")
+            atexit.register(executor.shutdown)
+            _executors[name] = executor
+        return _executors[name]
+
+
+if __name__ == "__main__":
+    # 用本地替身沙箱检查 E2BExecutor 传给 run_code 的参数：SANDBOX_BACKEND=local python -m src.tools.executors
+    os.environ["SANDBOX_BACKEND"] = "local"
+
+    streamed = []
+    executor = E2BExecutor()
+    execution = executor.run(
+        "demo",
+        "import sys\nprint('hello')\nprint('oops', file=sys.stderr)\nraise ValueError('bad')",
+        30,
+        on_stdout=lambda line: streamed.append(("stdout", line)),
+        on_stderr=lambda line: streamed.append(("stderr", line)),
+    )
+    assert ("stdout", "hello\n") in streamed and ("stderr", "oops\n") in streamed, streamed
+    assert execution.logs.stdout == ["hello\n"], execution.logs.stdout
+    assert execution.error is not None and execution.error.name == "ValueError", execution.error
+    print("输出回调与错误信息: 通过")
+
+    execution = executor.run("demo", "import time\nprint('start')\ntime.sleep(5)", 1,
+                             on_stdout=lambda line: streamed.append(("stdout", line)))
+    assert execution.error is not None and execution.error.name == "TimeoutError", execution.error
+    assert execution.logs.stdout == ["start\n"], execution.logs.stdout
+    print("超时: 通过")
@@ -1,7 +1,279 @@
+import mmap
 import os
+import re
+import tempfile
+import threading
+from array import array
+from collections.abc import Iterator
+from contextlib import contextmanager
+from itertools import islice
 from pathlib import Path
 
 from langchain.tools import tool
+from pydantic import BaseModel, Field
+
+from .file_cache import file_cache
+from .fs_walk import iter_tree
+
+# 行偏移索引的采样步长：每隔多少行记录一次行首字节偏移
+_INDEX_STRIDE = 256
+# 一次匹配 _INDEX_STRIDE 行，让建索引的扫描在正则引擎内部完成
+_STRIDE_PATTERN = re.compile(rb"(?:[^\n]*\n){%d}" % _INDEX_STRIDE)
+# 拷贝未改动区间时的分块大小
+_COPY_CHUNK_SIZE = 1024 * 1024
+# 未指定结束行时默认读取的行数
+DEFAULT_PAGE_LINES = 200
+
+
+class _LineIndex:
+    """
+    稀疏行偏移索引。
+
+    checkpoints[k] 是第 k * _INDEX_STRIDE + 1 行的行首字节偏移。
+    只记录采样点，内存约为 总行数 / _INDEX_STRIDE 个整数，
+    定位任意一行最多只需向后扫描 _INDEX_STRIDE - 1 个换行符。
+    """
+
+    def __init__(self, size: int, checkpoints: array | None = None):
+        self.size = size
+        self.checkpoints = checkpoints if checkpoints is not None else array("q", [0])
+        # None 表示采样点尚未扫描到文件末尾
+        self.total_lines: int | None = None
+        self._lock = threading.Lock()
+
+    def ensure_built(self, buf: bytes | mmap.mmap) -> None:
+        """从最后一个采样点继续扫描到文件末尾，补全采样点并统计总行数"""
+        with self._lock:
+            if self.total_lines is not None:
+                return
+
+            pos = self.checkpoints[-1]
+            match = _STRIDE_PATTERN.match(buf, pos)
+            while match:
+                pos = match.end()
+                self.checkpoints.append(pos)
+                match = _STRIDE_PATTERN.match(buf, pos)
+
+            # 剩余不足 _INDEX_STRIDE 行，逐行统计（最后一行可以没有换行符）
+            tail = 0
+            while pos < self.size:
+                tail += 1
+                newline = buf.find(b"\n", pos)
+                if newline == -1:
+                    break
+                pos = newline + 1
+
+            self.total_lines = (len(self.checkpoints) - 1) * _INDEX_STRIDE + tail
+
+    def line_offset(self, buf: bytes | mmap.mmap, line: int) -> int:
+        """返回第 line 行（从 1 开始）的行首偏移，超出总行数时返回文件末尾"""
+        if self.total_lines is None or line > self.total_lines:
+            return self.size
+        k, skip = divmod(line - 1, _INDEX_STRIDE)
+        pos = self.checkpoints[k]
+        for _ in range(skip):
+            pos = buf.find(b"\n", pos) + 1
+        return pos
+
+
+@contextmanager
+def _open_buffer(file_path: str) -> Iterator[tuple[os.stat_result, bytes | mmap.mmap]]:
+    """
+    打开文件供按字节切片读取。
+
+    小文件直接使用共享缓存里的整份字节，重复读取不再访问磁盘；
+    大文件以只读 mmap 映射，按需换页，内存占用与文件大小无关。
+    空文件无法映射，直接给出空字节串。
+    """
+    with open(file_path, "rb") as f:
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            yield st, b""
+            return
+
+        if st.st_size <= file_cache.max_entry_bytes:
+            data = file_cache.get(file_path, "bytes", st)
+            if data is None:
+                data = f.read()
+                # 读取过程中文件被改写时不缓存，交给下一次读取
+                if len(data) == st.st_size:
+                    file_cache.put(file_path, "bytes", data, len(data), st)
+                else:
+                    st = os.fstat(f.fileno())
+            yield st, data
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield st, mm
+
+
+def _index_cost(index: _LineIndex) -> int:
+    return len(index.checkpoints) * index.checkpoints.itemsize + 64
+
+
+def _get_line_index(file_path: str, st: os.stat_result, buf: bytes | mmap.mmap) -> _LineIndex:
+    """获取文件的行索引，文件未变化（mtime、size 一致）时复用共享缓存"""
+    index = file_cache.get(file_path, "line_index", st)
+    if index is None or index.total_lines is None:
+        index = index or _LineIndex(len(buf))
+        index.ensure_built(buf)
+        file_cache.put(file_path, "line_index", index, _index_cost(index), st)
+    return index
+
+
+def _seed_line_index(file_path: str, index: _LineIndex, line: int) -> None:
+    """
+    编辑之后，第 line 行之前的采样点依然有效。
+    把它们作为新文件的部分索引缓存起来，下次读取时只需从编辑位置继续扫描。
+    """
+    st = os.stat(file_path)
+    kept = index.checkpoints[:(line - 1) // _INDEX_STRIDE + 1]
+    seeded = _LineIndex(st.st_size, kept)
+    file_cache.put(file_path, "line_index", seeded, _index_cost(seeded), st)
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _copy_range(src_fd: int, dst_fd: int, start: int, end: int) -> None:
+    """把源文件 [start, end) 字节拷贝到目标文件当前位置，内存占用不超过一个分块"""
+    pos = start
+    # Linux 下优先走内核态拷贝，支持 reflink 的文件系统上几乎不产生实际 I/O
+    if hasattr(os, "copy_file_range"):
+        try:
+            while pos < end:
+                copied = os.copy_file_range(src_fd, dst_fd, end - pos, pos)
+                if copied == 0:
+                    break
+                pos += copied
+        except OSError:
+            pass
+    while pos < end:
+        chunk = os.pread(src_fd, min(_COPY_CHUNK_SIZE, end - pos), pos)
+        if not chunk:
+            break
+        _write_all(dst_fd, chunk)
+        pos += len(chunk)
+
+
+def _splice_file(file_path: str, size: int, edits: list[tuple[int, int, bytes]]) -> None:
+    """
+    按字节区间替换文件内容。
+
+    edits 为按起点排序、互不重叠的 (起始偏移, 结束偏移, 新内容) 列表。
+    - 只有一段替换且前后长度一致时，直接原地覆写这段字节；
+    - 否则把未改动的区间和新内容依次写入同目录临时文件，再原子替换原文件，
+      多段修改要么全部生效，要么都不生效。
+    """
+    if len(edits) == 1 and edits[0][1] - edits[0][0] == len(edits[0][2]):
+        start, _, data = edits[0]
+        with open(file_path, "r+b") as f:
+            f.seek(start)
+            f.write(data)
+        return
+
+    # 通过符号链接编辑时写入链接指向的文件，而不是把链接本身替换成普通文件
+    file_path = os.path.realpath(file_path)
+    directory = os.path.dirname(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".edit-", suffix=".tmp")
+    try:
+        with open(file_path, "rb") as src:
+            src_fd = src.fileno()
+            pos = 0
+            for start, end, data in edits:
+                _copy_range(src_fd, fd, pos, start)
+                _write_all(fd, data)
+                pos = end
+            _copy_range(src_fd, fd, pos, size)
+            # mkstemp 创建的文件权限为 0600，沿用原文件权限
+            if hasattr(os, "fchmod"):
+                os.fchmod(fd, os.fstat(src_fd).st_mode)
+        os.close(fd)
+        fd = -1
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if fd >= 0:
+            os.close(fd)
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _encode_new_text(new_text: str) -> bytes:
+    """把新内容拆成行，确保每行以换行符结束"""
+    new_lines = new_text.splitlines(keepends=True)
+    return "".join(ln if ln.endswith("\n") else ln + "\n" for ln in new_lines).encode("utf-8")
+
+
+def _apply_line_edits(file_path: str, hunks: list[tuple[int, int, str]]) -> None:
+    """
+    在一次读写中应用多段按行号的替换。
+
+    hunks 为 (start, end, new_text) 列表，行号均基于编辑前的原始文件，
+    要求 1 <= start <= end，且已按 start 排序、互不重叠。
+    超出文件末尾的区间会按顺序追加到文件末尾。
+    """
+    edits: list[tuple[int, int, bytes]] = []
+    with _open_buffer(file_path) as (st, buf):
+        index = _get_line_index(file_path, st, buf)
+        total_lines = index.total_lines
+        missing_newline = st.st_size > 0 and buf[-1:] != b"\n"
+
+        for start, end, new_text in hunks:
+            # 处理越界
+            start = min(start, total_lines + 1)
+            end = min(end, total_lines)
+
+            data = _encode_new_text(new_text)
+            byte_start = index.line_offset(buf, start)
+            # 如果 start 在文件末尾之后，则不删除，直接追加
+            byte_end = index.line_offset(buf, end + 1) if start <= total_lines else byte_start
+            # 追加时原文件最后一行没有换行符，先补上，避免新内容接在同一行
+            if byte_start == st.st_size and missing_newline:
+                data = b"\n" + data
+                missing_newline = False
+            edits.append((byte_start, byte_end, data))
+
+    _splice_file(file_path, st.st_size, edits)
+    file_cache.invalidate(file_path)
+    _seed_line_index(file_path, index, min(hunks[0][0], total_lines + 1))
+
+
+def _read_lines(buf: bytes | mmap.mmap, index: _LineIndex, start: int, end: int) -> list[str]:
+    """读取第 start 到 end 行（包含两端），只切片这一段字节"""
+    if end < start:
+        return []
+    chunk = buf[index.line_offset(buf, start):index.line_offset(buf, end + 1)]
+    lines = chunk.decode("utf-8").split("\n")
+    if chunk.endswith(b"\n"):
+        lines.pop()
+    return lines
+
+
+def page_bounds(start_line: int, end_line: int | None) -> tuple[int, int]:
+    """按 read_file 的规则计算要读取的行号区间（含两端），未指定结束行时读取从起始行开始的 200 行"""
+    actual_start = max(1, start_line)
+    actual_end = actual_start + DEFAULT_PAGE_LINES - 1 if end_line is None else end_line
+    return actual_start, actual_end
+
+
+def format_page(file_path: str, start_line: int, actual_start: int, actual_end: int,
+                lines: list[str], total_lines: int) -> str:
+    """按 read_file 的格式输出一页内容（带原始行号），空文件与起始行越界时返回提示"""
+    if total_lines == 0:
+        return "文件内容为空。"
+    if actual_start > total_lines:
+        return f"提示：起始行号 {start_line} 超过了文件总行数 {total_lines}。"
+
+    # 鲁棒性处理：确保结束行不越界
+    idx_end = min(actual_end, total_lines)
+    output = [f"{actual_start + i}: {line.rstrip()}" for i, line in enumerate(lines)]
+    header = f"--- 读取文件: {file_path} (第 {actual_start} 至 {idx_end} 行，总计 {total_lines} 行) ---\n"
+    return header + "\n".join(output)
 
 
 @tool
@@ -28,14 +300,15 @@ def read_file(file_path: str, start_line: int = 1, end_line: int | None = None)
             return f"错误：文件 {file_path} 不存在。"
         
         if os.path.isdir(file_path):
-            entries = sorted(os.listdir(file_path))
+            # scandir 自带类型信息，不必对每一项再调用 os.path.isdir
+            with os.scandir(file_path) as it:
+                entries = sorted((entry.name, entry.is_dir()) for entry in it)
             if not entries:
                 return f"目录为空：{file_path}"
 
-            output = [f"--- 目录内容: {file_path} (不递归) ---"]
-            for name in entries:
-                full_path = os.path.join(file_path, name)
-                if os.path.isdir(full_path):
+            output = [f"--- 目录内容: {file_path} (不递归，递归浏览请使用 list_directory) ---"]
+            for name, is_dir in entries:
+                if is_dir:
                     output.append(f"[DIR ] {name}")
                 else:
                     output.append(f"[FILE] {name}")
@@ -43,42 +316,78 @@ def read_file(file_path: str, start_line: int = 1, end_line: int | None = None)
             output.append(f"--- 共 {len(entries)} 项 ---")
             return "\n".join(output)
 
-        with open(file_path, encoding='utf-8') as f:
-            all_lines = f.readlines()
+        # 通过行索引定位到起始行，只读取需要的那一段，不再整文件 readlines
+        actual_start, actual_end = page_bounds(start_line, end_line)
+        with _open_buffer(file_path) as (st, buf):
+            index = _get_line_index(file_path, st, buf)
+            total_lines = index.total_lines
+            selected_lines = []
+            if 0 < actual_start <= total_lines:
+                selected_lines = _read_lines(buf, index, actual_start, min(actual_end, total_lines))
 
-        total_lines = len(all_lines)
-        if total_lines == 0:
-            return "文件内容为空。"
+        return format_page(file_path, start_line, actual_start, actual_end, selected_lines, total_lines)
 
-        # 默认逻辑处理：如果未指定结束行，默认读取 200 行
-        actual_start = max(1, start_line)
-        if end_line is None:
-            actual_end = actual_start + 199
-        else:
-            actual_end = end_line
+    except Exception as e:
+        return f"读取文件时发生未知错误: {str(e)}"
 
-        # 鲁棒性处理：确保索引不越界
-        # 将 1-based 转换为 0-based 索引
-        idx_start = min(actual_start - 1, total_lines - 1)
-        idx_end = min(actual_end, total_lines)
+@tool
+def list_directory(
+    dir_path: str,
+    max_depth: int = 3,
+    include: list[str] | None = None,
+    respect_gitignore: bool = True,
+    offset: int = 0,
+    limit: int = 200,
+) -> str:
+    """
+    递归列出目录树，支持 .gitignore、深度限制、通配符过滤和分页。
 
-        # 如果 start 大于实际总行数
-        if idx_start >= total_lines:
-            return f"提示：起始行号 {start_line} 超过了文件总行数 {total_lines}。"
+    使用场景：需要了解一个项目（尤其是大型仓库）的整体结构时，优先使用这个工具，
+    一次调用即可浏览多层目录，而不是对每个子目录分别调用 read_file。
 
-        selected_lines = all_lines[idx_start:idx_end]
-        
-        # 格式化输出，带上原始行号
-        output = []
-        for i, line in enumerate(selected_lines):
-            current_line_num = idx_start + i + 1
-            output.append(f"{current_line_num}: {line.rstrip()}")
-
-        header = f"--- 读取文件: {file_path} (第 {actual_start} 至 {idx_end} 行，总计 {total_lines} 行) ---\n"
-        return header + "\n".join(output)
+    参数说明:
+    - dir_path (str): 要浏览的目录路径。
+    - max_depth (int): 最大递归深度，1 表示只列出直接子项。默认为 3。
+    - include (list[str], 可选): 只列出匹配的文件，例如 ["*.py"] 或 ["src/**/*.ts"]。
+      不含 '/' 的模式只匹配文件名。指定后输出中不再单独列出目录。
+    - respect_gitignore (bool): 是否遵循 .gitignore 忽略规则，默认为 True。.git 目录总是被跳过。
+    - offset (int): 跳过前 offset 项，用于翻页。默认为 0。
+    - limit (int): 本次最多返回的项数，默认为 200。
+
+    输出说明:
+    - 每行一项，格式为 "[DIR ] 相对路径/" 或 "[FILE] 相对路径"，按目录深度优先、名称排序。
+    - 末尾会提示是否还有更多结果以及下一页的 offset。
+    """
+    try:
+        if not os.path.isdir(dir_path):
+            return f"错误：目录 {dir_path} 不存在。"
+
+        offset = max(0, offset)
+        limit = max(1, limit)
+        entries = iter_tree(dir_path, max_depth=max_depth, include=include, respect_gitignore=respect_gitignore)
+        # 多取一项判断是否还有下一页，遍历在取够之后立即停止
+        page = list(islice(entries, offset, offset + limit + 1))
+        has_more = len(page) > limit
+        page = page[:limit]
+
+        if not page:
+            return f"没有找到匹配的条目：{dir_path} (offset={offset})"
+
+        output = [f"--- 目录树: {dir_path} (深度 <= {max_depth}，第 {offset + 1} 至 {offset + len(page)} 项) ---"]
+        for item in page:
+            if item.is_dir:
+                output.append(f"[DIR ] {item.path}/")
+            else:
+                output.append(f"[FILE] {item.path}")
+
+        if has_more:
+            output.append(f"--- 还有更多条目，下一页请使用 offset={offset + len(page)} ---")
+        else:
+            output.append("--- 已列出全部条目 ---")
+        return "\n".join(output)
 
     except Exception as e:
-        return f"读取文件时发生未知错误: {str(e)}"
+        return f"列出目录时发生未知错误: {str(e)}"
 
 @tool
 def write_file(file_path: str, content: str) -> str:
@@ -104,6 +413,7 @@ def write_file(file_path: str, content: str) -> str:
         # 写入文件
         with open(path, 'w', encoding='utf-8') as f:
             f.write(content)
+        file_cache.invalidate(file_path)
             
         return f"成功：目录已补齐，内容已写入 {file_path}。"
     except Exception as e:
@@ -115,6 +425,7 @@ def edit_file_by_line(file_path: str, start_line: int, end_line: int, new_text:
     按指定行号范围编辑文件内容（替换区间内行，并在必要时挤开后续内容）。
 
     使用场景：当文件内容过长时，例如行数超过了 200 行，并且需要修改指定的部分内容或较小内容变动时，可以使用这个工具。
+    如果需要修改同一个文件中的多个位置，请改用 edit_file_by_hunks 一次性提交。
 
     功能说明：
     - 将文件中从 start_line 到 end_line （包含两端）这一段替换为 new_text。
@@ -159,44 +470,88 @@ def edit_file_by_line(file_path: str, start_line: int, end_line: int, new_text:
         if not os.path.exists(file_path):
             return f"错误：文件 {file_path} 不存在。"
 
-        with open(file_path, encoding="utf-8") as f:
-            lines = f.readlines()
-
-        total_lines = len(lines)
-
         # 限制行号在合理区间
         start = max(1, start_line)
         end = max(1, end_line)
         if start > end:
             return f"错误：起始行 {start_line} 不能大于结束行 {end_line}。"
 
-        # 处理越界
-        start = min(start, total_lines + 1)
-        end = min(end, total_lines)
+        # 通过行索引把行号区间换算成字节区间，只改写这一段
+        _apply_line_edits(file_path, [(start, end, new_text)])
 
-        # new_text 处理成单行列表
-        new_lines = new_text.splitlines(keepends=True)
-        if not new_lines:
-            new_lines = []
+        return f"成功：文件 {file_path} 的第 {start_line} 到 {end_line} 行已更新。"
 
-        # 实际替换区间长度
-        old_segment_len = end - start + 1 if total_lines > 0 else 0
+    except Exception as e:
+        return f"编辑失败: {str(e)}"
 
-        # 先删除旧行片段
-        # 如果 start 在文件末尾之后，则不删除
-        if start <= total_lines:
-            del lines[start-1:start-1+old_segment_len]
 
-        # 再插入 new_lines
-        insert_pos = start - 1
-        for i, ln in enumerate(new_lines):
-            # 确保每行以换行符结束
-            lines.insert(insert_pos + i, ln if ln.endswith("\n") else ln + "\n")
+class EditHunk(BaseModel):
+    start_line: int = Field(description="起始行号（从 1 开始，基于编辑前的原始文件）")
+    end_line: int = Field(description="结束行号（包含，>= start_line，基于编辑前的原始文件）")
+    new_text: str = Field(description="替换该区间的新内容，可以包含多行")
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.writelines(lines)
 
-        return f"成功：文件 {file_path} 的第 {start_line} 到 {end_line} 行已更新。"
+@tool
+def edit_file_by_hunks(file_path: str, hunks: list[EditHunk]) -> str:
+    """
+    一次性对同一个文件应用多段按行号的替换（批量版 edit_file_by_line）。
+
+    使用场景：需要修改同一个文件中的多个位置时，优先使用这个工具，
+    而不是连续多次调用 edit_file_by_line。
+
+    功能说明：
+    - 所有 hunk 的行号都以 **编辑前的原始文件** 为准，无需自行计算前面的修改造成的行号偏移。
+    - 每个 hunk 的替换规则与 edit_file_by_line 相同（替换区间、挤开后续内容、自动补换行符）。
+    - 所有 hunk 在一次读写中完成，要么全部生效，要么都不生效。
+    - hunk 之间的行号区间不能重叠，否则返回错误信息，文件保持不变。
+
+    参数：
+        file_path (str): 目标文件路径。
+        hunks (list): 替换列表，每项包含 start_line、end_line、new_text。
+
+    示例行为：
+        原始文件：
+            1 a
+            2 b
+            3 c
+            4 d
+
+        edit_file_by_hunks("f.txt", [
+            {"start_line": 1, "end_line": 1, "new_text": "x\ny"},
+            {"start_line": 3, "end_line": 4, "new_text": "z"},
+        ])
+        => 文件结果：
+            1 x
+            2 y
+            3 b
+            4 z
+    """
+    try:
+        if not os.path.exists(file_path):
+            return f"错误：文件 {file_path} 不存在。"
+        if not hunks:
+            return "错误：hunks 不能为空。"
+
+        normalized: list[tuple[int, int, str]] = []
+        for hunk in hunks:
+            if isinstance(hunk, dict):
+                hunk = EditHunk(**hunk)
+            # 限制行号在合理区间
+            start = max(1, hunk.start_line)
+            end = max(1, hunk.end_line)
+            if start > end:
+                return f"错误：起始行 {hunk.start_line} 不能大于结束行 {hunk.end_line}。"
+            normalized.append((start, end, hunk.new_text))
+
+        # 按起始行排序后检查相邻区间是否重叠
+        normalized.sort(key=lambda h: h[0])
+        for prev, cur in zip(normalized, normalized[1:]):
+            if cur[0] <= prev[1]:
+                return f"错误：第 {prev[0]}-{prev[1]} 行与第 {cur[0]}-{cur[1]} 行的修改区间重叠。"
+
+        _apply_line_edits(file_path, normalized)
+
+        return f"成功：文件 {file_path} 的 {len(normalized)} 处修改已一次性更新。"
 
     except Exception as e:
-        return f"编辑失败: {str(e)}"
\ No newline at end of file
+        return f"编辑失败: {str(e)}"
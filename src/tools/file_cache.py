@@ -0,0 +1,152 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Any
+
+# 缓存总预算，默认 64 MB，可通过环境变量 FILE_CACHE_MAX_BYTES 调整
+DEFAULT_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 缓存条目的键: (绝对路径, mtime_ns, size, 种类)
+CacheKey = tuple[str, int, int, Hashable]
+
+
+class FileCache:
+    """
+    进程内共享的文件读取缓存（LRU + 字节预算）。
+
+    - 以 (路径, mtime, size) 标识文件内容，文件被修改后旧条目不会再命中；
+    - 同一个文件可以缓存多种结果（原始字节、行索引、搜索结果等），用 kind 区分；
+    - 写文件的工具应调用 invalidate，立即释放该文件的所有条目；
+    - 通过 stats() 查看命中率，评估重复读取带来的 I/O 开销。
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # 单个条目最多占预算的 1/8，避免一个大文件把其他条目全部挤出去
+        self.max_entry_bytes = max_bytes // 8
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes_served = 0
+
+        self._entries: OrderedDict[CacheKey, tuple[Any, int]] = OrderedDict()
+        self._keys_by_path: dict[str, set[CacheKey]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_key(file_path: str, kind: Hashable, st: os.stat_result | None) -> CacheKey:
+        if st is None:
+            st = os.stat(file_path)
+        return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size, kind)
+
+    def get(self, file_path: str, kind: Hashable, st: os.stat_result | None = None) -> Any | None:
+        """命中返回缓存值，未命中返回 None"""
+        key = self._make_key(file_path, kind, st)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_served += entry[1]
+            return entry[0]
+
+    def put(
+        self,
+        file_path: str,
+        kind: Hashable,
+        value: Any,
+        cost: int,
+        st: os.stat_result | None = None,
+    ) -> None:
+        """写入缓存，cost 为该条目占用的估算字节数"""
+        if cost > self.max_entry_bytes:
+            return
+        key = self._make_key(file_path, kind, st)
+        with self._lock:
+            # 同一文件同一种类只保留最新的一份
+            for stale in [k for k in self._keys_by_path.get(key[0], ()) if k[3] == kind]:
+                self._remove(stale)
+            self._entries[key] = (value, cost)
+            self._keys_by_path.setdefault(key[0], set()).add(key)
+            self.current_bytes += cost
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(
+        self,
+        file_path: str,
+        kind: Hashable,
+        loader: Callable[[], tuple[Any, int]],
+        st: os.stat_result | None = None,
+    ) -> Any:
+        """未命中时调用 loader 读取，loader 返回 (值, 估算字节数)"""
+        if st is None:
+            st = os.stat(file_path)
+        value = self.get(file_path, kind, st)
+        if value is None:
+            value, cost = loader()
+            self.put(file_path, kind, value, cost, st)
+        return value
+
+    def read_bytes(self, file_path: str) -> bytes:
+        """读取整个文件的字节内容，优先使用缓存"""
+        def load() -> tuple[bytes, int]:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            return data, len(data)
+
+        return self.get_or_load(file_path, "bytes", load)
+
+    def invalidate(self, file_path: str) -> None:
+        """丢弃某个文件的全部缓存条目，写文件后调用"""
+        path = os.path.abspath(file_path)
+        with self._lock:
+            keys = self._keys_by_path.get(path)
+            if not keys:
+                return
+            for key in list(keys):
+                self._remove(key)
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_path.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict[str, int | float]:
+        """返回命中/未命中等计数，用于观察重复读取的开销"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "bytes_served": self.bytes_served,
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key: CacheKey) -> None:
+        # 调用方需持有 self._lock
+        _, cost = self._entries.pop(key)
+        self.current_bytes -= cost
+        keys = self._keys_by_path.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_path[key[0]]
+
+
+# 全局共享实例，供 file.py / rg_search.py 等工具共同使用
+file_cache = FileCache()
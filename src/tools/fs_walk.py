@@ -0,0 +1,159 @@
+import os
+import re
+from collections.abc import Iterator
+from typing import NamedTuple
+
+# 无论 .gitignore 如何配置都不进入的目录
+ALWAYS_SKIP_DIRS = {".git"}
+
+
+class TreeEntry(NamedTuple):
+    path: str  # 相对遍历根目录的路径，统一使用 '/' 分隔
+    is_dir: bool
+    depth: int  # 根目录下的直接子项深度为 1
+    entry: os.DirEntry  # 原始 DirEntry，entry.stat() 会复用 scandir 的结果
+
+
+def _translate_glob(pattern: str) -> str:
+    """把 gitignore 风格的通配符转换为正则表达式（支持 **、*、?、[...]）"""
+    i, n = 0, len(pattern)
+    out = []
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            close = pattern.find("]", i + 2)
+            if close == -1:
+                out.append(re.escape(c))
+                i += 1
+            else:
+                body = pattern[i + 1:close]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = close + 1
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+class _IgnoreRule:
+    def __init__(self, base: str, line: str):
+        self.base = base  # 规则所在 .gitignore 的目录（相对遍历根目录，根为 ""）
+        self.negate = line.startswith("!")
+        if self.negate:
+            line = line[1:]
+        self.dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # 模式中含有 '/' 时相对 .gitignore 所在目录匹配，否则匹配任意层级的名称
+        self.anchored = "/" in line
+        self.regex = re.compile(_translate_glob(line.lstrip("/")))
+
+    def matches(self, rel_path: str, name: str, is_dir: bool) -> bool:
+        if self.dir_only and not is_dir:
+            return False
+        if not self.anchored:
+            return self.regex.fullmatch(name) is not None
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return False
+            rel_path = rel_path[len(self.base) + 1:]
+        return self.regex.fullmatch(rel_path) is not None
+
+
+def _load_gitignore(dir_path: str, base: str) -> list[_IgnoreRule]:
+    try:
+        with open(os.path.join(dir_path, ".gitignore"), encoding="utf-8", errors="replace") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+
+    rules = []
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("\\#") or line.startswith("\\!"):
+            line = line[1:]
+        rules.append(_IgnoreRule(base, line))
+    return rules
+
+
+def _is_ignored(rules: list[_IgnoreRule], rel_path: str, name: str, is_dir: bool) -> bool:
+    # 与 git 一致：后出现的规则优先，所以倒序找到第一条匹配的规则即可
+    for rule in reversed(rules):
+        if rule.matches(rel_path, name, is_dir):
+            return not rule.negate
+    return False
+
+
+def iter_tree(
+    root: str,
+    max_depth: int | None = None,
+    include: list[str] | None = None,
+    respect_gitignore: bool = True,
+) -> Iterator[TreeEntry]:
+    """
+    深度优先、按名称排序地遍历目录树，边遍历边产出结果。
+
+    - 基于 os.scandir，类型判断复用目录项自带的信息，不会对每个文件重复 stat；
+    - respect_gitignore 为 True 时逐级加载 .gitignore，被忽略的目录整体跳过；
+    - include 为通配符列表（如 ["*.py", "src/**/*.ts"]），指定后只产出匹配的文件；
+    - max_depth 限制遍历深度，根目录的直接子项深度为 1。
+
+    调用方只消费需要的条目即可，未消费的部分不会被遍历。
+    """
+    # 不含 '/' 的模式只匹配文件名，其余匹配相对路径
+    include_res = [(re.compile(_translate_glob(p)), "/" in p) for p in include or []]
+
+    def wanted(rel_path: str, name: str) -> bool:
+        if not include_res:
+            return True
+        return any(r.fullmatch(rel_path if by_path else name) for r, by_path in include_res)
+
+    def walk(dir_path: str, rel_dir: str, depth: int, rules: list[_IgnoreRule]) -> Iterator[TreeEntry]:
+        if respect_gitignore:
+            rules = rules + _load_gitignore(dir_path, rel_dir)
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError:
+            return
+
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                # 不跟随符号链接进入目录，避免循环
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir and entry.name in ALWAYS_SKIP_DIRS:
+                continue
+            if rules and _is_ignored(rules, rel_path, entry.name, is_dir):
+                continue
+
+            if is_dir:
+                if not include_res:
+                    yield TreeEntry(rel_path, True, depth, entry)
+                if max_depth is None or depth < max_depth:
+                    yield from walk(entry.path, rel_path, depth + 1, rules)
+            elif wanted(rel_path, entry.name):
+                yield TreeEntry(rel_path, False, depth, entry)
+
+    yield from walk(root, "", 1, [])
+
@@ -35,20 +35,37 @@ def collaborative_discussion(expert_system_prompt: str, discussion_topic: str) -
     - 专家 LLM 的详细建议。Agent 应当根据此建议更新当前 Plan 状态或细化后续步骤。
     """
     
-    messages = [
+    try:
+        response = model.invoke(_discussion_messages(expert_system_prompt, discussion_topic))
+        return _format_discussion(response.content)
+    except Exception as e:
+        return f"讨论工具调用失败: {str(e)}"
+
+
+def _discussion_messages(expert_system_prompt: str, discussion_topic: str) -> list:
+    return [
         SystemMessage(content=expert_system_prompt),
         HumanMessage(content=discussion_topic)
     ]
-    
+
+
+def _format_discussion(content: str) -> str:
+    # 格式化输出，方便 Agent 吸收信息
+    return (
+        f"--- 外部专家讨论结果 ---\n"
+        f"提示: 参考下述建议，你如果还需要建议，可以进行多次交谈。\n"
+        f"---------------------------\n"
+        f"{content}\n"
+    )
+
+
+async def _acollaborative_discussion(expert_system_prompt: str, discussion_topic: str) -> str:
+    """collaborative_discussion 的原生异步实现，等待专家模型时不占用线程"""
     try:
-        response = model.invoke(messages)
-        # 格式化输出，方便 Agent 吸收信息
-        formatted_response = (
-            f"--- 外部专家讨论结果 ---\n"
-            f"提示: 参考下述建议，你如果还需要建议，可以进行多次交谈。\n"
-            f"---------------------------\n"
-            f"{response.content}\n"
-        )
-        return formatted_response
+        response = await model.ainvoke(_discussion_messages(expert_system_prompt, discussion_topic))
+        return _format_discussion(response.content)
     except Exception as e:
         return f"讨论工具调用失败: {str(e)}"
+
+
+collaborative_discussion.coroutine = _acollaborative_discussion
@@ -1,32 +1,51 @@
-import re
+from typing import Any
 
-from langchain_core.tools import tool
+from langchain.tools import BaseTool, ToolRuntime, tool
 from pydantic import BaseModel, Field
 
-# 模拟数据库，实际应用中可以持久化到文件或数据库
-# 数据格式: {"1": {"task": "搜索相关论文", "status": "completed"}, ...}
-plan_storage: dict[str, dict[str, str]] = {}
+from ..tool_runner import invoke_tool_call
+from .plan_scheduler import PlanScheduler
+from .plan_store import Plan, PlanStep, get_plan_store
+from .session import session_id_of
 
 class PlanItem(BaseModel):
     plan_id: str = Field(description="任务的唯一标识符，如 '1', '2' 或 'task_1'")
     task: str = Field(description="具体的任务描述内容")
     status: str = Field(description="任务状态，可选值: 'todo', 'in_progress', 'completed', 'failed'")
-    
-def extract_index(plan_id: str) -> int:
-    """辅助函数：从 plan_step_N 格式中提取数字索引"""
-    match = re.search(r'plan_step_(\d+)', plan_id)
-    
-    if match:
-        return int(match.group(1))
-    else:
-        raise ValueError(f"任务 ID 错误: {plan_id}")
-    
+
+
+class PlanStepSpec(BaseModel):
+    plan_id: str = Field(description="步骤的唯一 ID，必须以 'plan_step_' 开头，例如 'plan_step_search_docs'")
+    task: str = Field(description="具体的任务描述内容")
+    depends_on: list[str] = Field(default_factory=list, description="必须先完成的步骤 ID 列表，没有依赖则留空")
+    sub_steps: list["PlanStepSpec"] = Field(
+        default_factory=list,
+        description="子步骤列表，子步骤继承本步骤的依赖；所有子步骤完成后本步骤自动完成",
+    )
+
+
+class StepAssignment(BaseModel):
+    plan_id: str = Field(description="要执行的步骤 ID")
+    tool: str = Field(description="执行该步骤时调用的工具名，例如 'google_search'")
+    args: dict[str, Any] = Field(default_factory=dict, description="传给该工具的参数")
+
+
+def _flatten_specs(specs: list[PlanStepSpec], parent_id: str | None = None) -> list[PlanStep]:
+    """按先序展开嵌套的子步骤，父步骤排在它的子步骤之前"""
+    steps = []
+    for spec in specs:
+        if not spec.plan_id.startswith("plan_step_"):
+            raise ValueError(f"步骤 ID 必须以 'plan_step_' 开头: {spec.plan_id}")
+        steps.append(PlanStep(spec.plan_id, spec.task, depends_on=list(spec.depends_on), parent_id=parent_id))
+        steps.extend(_flatten_specs(spec.sub_steps, spec.plan_id))
+    return steps
+
 
 with open("src/tools/todowrite.txt") as f:
     DESCRIPTION_WRITE = f.read()
     
 @tool(description=DESCRIPTION_WRITE)
-def init_planning(tasks: list[str]) -> str:
+def init_planning(tasks: list[str], runtime: ToolRuntime) -> str:
     """
     【规划创建工具】用于创建详细的任务执行步骤和规划。
     
@@ -42,16 +61,81 @@ def init_planning(tasks: list[str]) -> str:
     参数:
     - tasks: 任务描述字符串列表。示例: ["搜索AI最新进展", "分析AI最新进展数据", "编写解析脚本", "检查解析结果"]
     """
-    global plan_storage
-    plan_storage.clear()
-    for i, task_desc in enumerate(tasks, 1):
-        plan_id = f"plan_step_{i}"
-        plan_storage[plan_id] = {"task": task_desc, "status": "todo"}
+    session_id = session_id_of(runtime)
+    store = get_plan_store()
+    with store.lock(session_id):
+        store.replace(session_id, Plan.from_tasks(tasks))
     
     return f"计划已初始化，共创建 {len(tasks)} 个步骤。请从 plan_step_1 开始执行。"
 
+
+def _ready_text(plan: Plan) -> str:
+    ready = plan.ready_steps()
+    if not ready:
+        return "当前没有可执行的步骤。"
+    return "当前可执行的步骤: " + ", ".join(step.plan_id for step in ready)
+
+
+@tool
+def init_plan_graph(steps: list[PlanStepSpec], runtime: ToolRuntime) -> str:
+    """
+    【依赖规划创建工具】创建带依赖关系和子步骤的计划，互不依赖的步骤可以并行执行。
+
+    与 init_planning 的区别：init_planning 创建严格按顺序执行的线性计划；
+    当任务中存在彼此独立的工作（例如"搜索文档"和"搭建项目骨架"）时使用本工具，
+    这些步骤会同时处于可执行状态，可以在同一轮中并行调用工具完成。
+
+    注意：
+    - 调用此工具会清空已有的计划。
+    - 步骤 ID 由你指定，必须以 'plan_step_' 开头且不能重复。
+    - depends_on 只能引用计划中存在的步骤，且不能形成循环依赖。
+    - 子步骤自动继承父步骤的依赖；父步骤在所有子步骤完成后自动标记为 completed。
+
+    参数:
+    - steps: 步骤列表。示例:
+      [{"plan_id": "plan_step_docs", "task": "搜索框架文档"},
+       {"plan_id": "plan_step_scaffold", "task": "搭建项目骨架", "sub_steps": [
+           {"plan_id": "plan_step_scaffold_init", "task": "初始化项目"},
+           {"plan_id": "plan_step_scaffold_deps", "task": "安装依赖", "depends_on": ["plan_step_scaffold_init"]}]},
+       {"plan_id": "plan_step_impl", "task": "实现功能", "depends_on": ["plan_step_docs", "plan_step_scaffold"]}]
+    """
+    if not steps:
+        return "错误：steps 不能为空。"
+    try:
+        plan = Plan(_flatten_specs(steps))
+    except ValueError as e:
+        return f"错误：{e}"
+
+    session_id = session_id_of(runtime)
+    store = get_plan_store()
+    with store.lock(session_id):
+        store.replace(session_id, plan)
+    return f"计划已初始化，共创建 {len(plan)} 个步骤。{_ready_text(plan)}，互不依赖的步骤可以并行执行。"
+
+
 @tool
-def get_plans(plan_id: str | None = None) -> str:
+def get_ready_steps(runtime: ToolRuntime) -> str:
+    """
+    【就绪步骤查询工具】列出当前所有依赖都已完成、可以立即执行的步骤。
+    返回的步骤之间互不依赖，可以在同一轮中同时调用多个工具并行完成。
+    """
+    session_id = session_id_of(runtime)
+    store = get_plan_store()
+    with store.lock(session_id):
+        plan = store.load(session_id)
+        if not plan:
+            return "当前没有计划。请先调用 init_planning 或 init_plan_graph 创建计划。"
+        if plan.all_completed():
+            return "所有任务已完成。"
+        ready = plan.ready_steps()
+    if not ready:
+        return "当前没有可执行的步骤：剩余步骤的前置步骤未完成（可能有步骤处于 failed 状态，需要重新处理）。"
+    lines = [f"可执行的步骤（共 {len(ready)} 个，互不依赖）:"]
+    lines += [f"- ID: {step.plan_id} | 任务: {step.task} | 状态: {step.status}" for step in ready]
+    return "\n".join(lines)
+
+@tool
+def get_plans(runtime: ToolRuntime, plan_id: str | None = None) -> str:
     """
     【规划查看工具】读取当前的执行计划（Plan/Todo List）。
     
@@ -62,66 +146,142 @@ def get_plans(plan_id: str | None = None) -> str:
     参数:
     - plan_id: 可选，特定任务的ID。如果不提供，则返回所有任务。
     """
-    if not plan_storage:
-        return "当前没有计划。请先调用 init_planning 创建计划。"
-    
-    if plan_id:
-        if not plan_id.startswith("plan_step_"):
-            return "错误：plan_id 必须以 'plan_step_' 开头，例如 'plan_step_1'。"
-        plan = plan_storage.get(plan_id)
-        return f"详情 [{plan_id}]: {plan['task']} | 状态: {plan['status']}" if plan else "未找到该步骤。"
-
-    # 逻辑：寻找第一个状态不是 completed 的任务作为“当前任务”
-    output = "--- 执行计划清单 ---"
-    current_found = False
-    for pid, info in plan_storage.items():
-        status = info['status']
-        prefix = "[ ]"
-        suffix = ""
-        
-        if status == "completed":
-            prefix = "[DONE]"
-        elif not current_found and status in ["todo", "in_progress"]:
-            prefix = "[ACTIVE ->]" # 特别强调
-            suffix = " <-- 这是你当前唯一需要关注和执行的任务"
-            current_found = True
-        
-        output += f"\n{prefix} ID: {pid} | 任务: {info['task']} | 状态: {status}{suffix}"
-    
-    if not current_found:
-        output += "\n\n提示：所有任务已完成或没有待办任务。"
-    
-    return output
+    if plan_id and not plan_id.startswith("plan_step_"):
+        return "错误：plan_id 必须以 'plan_step_' 开头，例如 'plan_step_1'。"
+
+    session_id = session_id_of(runtime)
+    store = get_plan_store()
+    with store.lock(session_id):
+        plan = store.load(session_id)
+        if not plan:
+            return "当前没有计划。请先调用 init_planning 创建计划。"
+
+        if plan_id:
+            step = plan.get(plan_id)
+            return f"详情 [{plan_id}]: {step.task} | 状态: {step.status}" if step else "未找到该步骤。"
+
+        # 第一个状态不是 completed 的步骤就是"当前任务"
+        return plan.render()
 
 @tool
 def update_plan(
     plan_id: str, 
     status: str,
+    runtime: ToolRuntime,
 ) -> str:
     """
     【规划更新工具】仅用于更新现有任务的状态。不能创建新任务。
     
     严格约束：
-    - 必须按顺序执行：只有 ID 较小的步骤状态为 'completed'，才能操作下一个步骤。
+    - 必须按顺序执行：只有步骤的所有前置步骤状态为 'completed'，才能操作该步骤。
+      init_planning 创建的计划中，前置步骤就是 ID 较小的所有步骤。
     - 禁止跨步更新：例如在 plan_step_1 未完成时，禁止更新 plan_step_2。
     - 状态流转建议：todo -> in_progress -> completed。
     
     参数:
-    - plan_id: 格式必须为 'plan_step_N' (例如 'plan_step_1')。
+    - plan_id: 格式必须为 'plan_step_N' (例如 'plan_step_1')，或 init_plan_graph 中指定的 ID。
     - status: 目标状态 (todo, in_progress, completed, failed)。
     """
-    global plan_storage
-    if plan_id not in plan_storage:
-        return f"错误：任务 {plan_id} 不存在。请使用 get_plans 查看整体 plan 确认"
+    session_id = session_id_of(runtime)
+    store = get_plan_store()
+    # 校验和更新在同一把会话锁内完成，避免并发调用看到过期的前置状态
+    with store.lock(session_id):
+        plan = store.load(session_id)
+        if not plan or plan.get(plan_id) is None:
+            return f"错误：任务 {plan_id} 不存在。请使用 get_plans 查看整体 plan 确认"
 
-    sorted_keys = sorted(plan_storage.keys(), key=extract_index)
-    current_idx = sorted_keys.index(plan_id)
-    
-    for i in range(current_idx):
-        prev_id = sorted_keys[i]
-        if plan_storage[prev_id]["status"] != "completed":
-            return f"更新拒绝！前置步骤 {prev_id} 尚未完成。请保持专注，按顺序逐一执行任务。"
-
-    # 更新状态
-    plan_storage[plan_id]["status"] = status
-    return f"任务 {plan_id} 状态已更新为 {status}。"
+        # 只需查看该步骤尚未完成的前置步骤计数
+        blocker = plan.blocker(plan_id)
+        if blocker is not None:
+            return (f"更新拒绝！前置步骤 {blocker.plan_id} 尚未完成。请保持专注，按顺序逐一执行任务。"
+                    f"{_ready_text(plan)}")
+
+        # 更新状态
+        cascaded = plan.set_status(plan_id, status)
+        store.save_status(session_id, plan, [plan_id] + cascaded)
+        message = f"任务 {plan_id} 状态已更新为 {status}。"
+        if cascaded:
+            message += " 父步骤 " + ", ".join(f"{pid} -> {plan.get(pid).status}" for pid in cascaded) + "。"
+        if status == "completed" and not plan.sequential:
+            message += _ready_text(plan) if not plan.all_completed() else "所有任务已完成。"
+    return message
+
+
+def make_run_plan_steps(tools: list[BaseTool], max_workers: int = 4) -> BaseTool:
+    """
+    创建 run_plan_steps 工具：把计划步骤分别交给一次工具调用执行，由 PlanScheduler 按依赖关系调度。
+    tools 为步骤可以使用的工具，由组装 agent 的地方传入，避免计划模块依赖具体的工具模块。
+    """
+    tools_by_name = {t.name: t for t in tools}
+
+    @tool
+    def run_plan_steps(assignments: list[StepAssignment], runtime: ToolRuntime) -> str:
+        """
+        【计划并行执行工具】为计划中的步骤各指定一次工具调用，按依赖关系自动并行执行并更新步骤状态。
+
+        使用场景：init_plan_graph 创建的计划中，多个步骤各自只需要一次工具调用即可完成
+        （例如同时搜索几份文档、抓取几个网页）。互不依赖的步骤会同时执行；
+        某个步骤完成后，依赖它的已指定步骤会立即开始，无需等待下一轮。
+
+        规则：
+        - 步骤开始时标记为 in_progress，工具调用成功后标记为 completed，出错则标记为 failed，
+          依赖失败步骤的步骤不会执行。
+        - 只执行这里指定了工具调用的步骤；包含子步骤的父步骤不能指定，它在子步骤都完成后自动完成。
+        - 返回每个步骤的工具输出，之后请用 get_plans / get_ready_steps 查看整体进度。
+
+        参数:
+        - assignments: 步骤与工具调用的对应列表。示例:
+          [{"plan_id": "plan_step_docs", "tool": "google_search", "args": {"query": "vite 最佳实践"}},
+           {"plan_id": "plan_step_read", "tool": "browserless_web_loader", "args": {"url": "https://vite.dev/guide/"}}]
+        """
+        if not assignments:
+            return "错误：assignments 不能为空。"
+
+        session_id = session_id_of(runtime)
+        store = get_plan_store()
+        by_step: dict[str, StepAssignment] = {}
+        with store.lock(session_id):
+            plan = store.load(session_id)
+            if not plan:
+                return "当前没有计划。请先调用 init_plan_graph 创建计划。"
+            for assignment in assignments:
+                step = plan.get(assignment.plan_id)
+                if step is None:
+                    return f"错误：任务 {assignment.plan_id} 不存在。请使用 get_plans 查看整体 plan 确认"
+                if assignment.plan_id in by_step:
+                    return f"错误：步骤 {assignment.plan_id} 被指定了多次。"
+                if plan.has_children(assignment.plan_id):
+                    return f"错误：{assignment.plan_id} 包含子步骤，请为它的子步骤分别指定工具调用。"
+                if step.status == "completed":
+                    return f"错误：步骤 {assignment.plan_id} 已经完成。"
+                if assignment.tool not in tools_by_name:
+                    return f"错误：未知的工具 {assignment.tool}。"
+                by_step[assignment.plan_id] = assignment
+
+        def execute(step: PlanStep) -> str:
+            assignment = by_step[step.plan_id]
+            message = invoke_tool_call(
+                tools_by_name[assignment.tool],
+                {"name": assignment.tool, "args": assignment.args,
+                 "id": f"{runtime.tool_call_id}:{step.plan_id}", "type": "tool_call"},
+                runtime.state,
+                runtime.config,
+            )
+            if message.status == "error":
+                raise RuntimeError(message.content)
+            return str(message.content)
+
+        results = PlanScheduler(session_id, store, max_workers).run(execute, set(by_step))
+
+        lines = [f"已执行 {len(results)} 个步骤:"]
+        for plan_id, result in results.items():
+            lines.append(f"[{plan_id}] ({by_step[plan_id].tool})\n{result}")
+        skipped = [plan_id for plan_id in by_step if plan_id not in results]
+        if skipped:
+            lines.append(f"未执行（前置步骤未完成或失败）: {', '.join(skipped)}")
+        with store.lock(session_id):
+            plan = store.load(session_id)
+            lines.append("所有任务已完成。" if plan.all_completed() else _ready_text(plan))
+        return "\n".join(lines)
+
+    return run_plan_steps
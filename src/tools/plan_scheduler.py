@@ -0,0 +1,153 @@
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+from .plan_store import PlanStep, PlanStore, get_plan_store
+
+
+class PlanScheduler:
+    """
+    按依赖关系并发执行一个会话的计划。
+
+    每一轮把就绪集合中尚未开始的步骤全部提交到线程池，
+    任意一个步骤结束后立即更新状态并提交因此变为就绪的新步骤，
+    因此互不依赖的步骤会同时执行，关键路径之外的步骤不会互相等待。
+
+    包含子步骤的父步骤不会被执行：它在所有子步骤完成后由 Plan 自动标记为完成。
+    执行函数抛出异常的步骤标记为 failed，依赖它的步骤不会再被调度。
+    执行期间计划被替换或清空时，已提交的步骤照常记录结果，但不再写入状态。
+    """
+
+    def __init__(self, session_id: str, store: PlanStore | None = None, max_workers: int = 4):
+        self.session_id = session_id
+        self.store = store or get_plan_store()
+        self.max_workers = max_workers
+
+    def _set_status(self, step: PlanStep, status: str, expected: str) -> bool:
+        """
+        步骤仍在当前计划中（任务相同）且状态为 expected 时更新为 status 并返回 True；
+        计划已被替换或清空、步骤不存在时不写入，返回 False。
+        """
+        with self.store.lock(self.session_id):
+            plan = self.store.load(self.session_id)
+            current = plan.get(step.plan_id) if plan is not None else None
+            if current is None or current.task != step.task or current.status != expected:
+                return False
+            cascaded = plan.set_status(step.plan_id, status)
+            self.store.save_status(self.session_id, plan, [step.plan_id] + cascaded)
+            return True
+
+    def _dispatchable(self, running: set[str], finished: set[str], plan_ids: set[str] | None) -> list[PlanStep]:
+        with self.store.lock(self.session_id):
+            plan = self.store.load(self.session_id)
+            if plan is None:
+                return []
+            return [
+                step for step in plan.ready_steps()
+                if step.plan_id not in running
+                and step.plan_id not in finished
+                and (plan_ids is None or step.plan_id in plan_ids)
+                and step.status != "failed"
+                and not plan.has_children(step.plan_id)
+            ]
+
+    def run(self, execute: Callable[[PlanStep], str], plan_ids: set[str] | None = None) -> dict[str, str]:
+        """
+        执行计划直到没有可调度的步骤，返回 {步骤 ID: 执行结果或错误信息}。
+        execute 接收一个步骤并返回结果文本，会在线程池中并发调用。
+        plan_ids 不为 None 时只调度其中的步骤，其余步骤留给调用方自行处理。
+        """
+        results: dict[str, str] = {}
+        running: dict[Future, PlanStep] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="plan-step") as pool:
+            while True:
+                running_ids = {step.plan_id for step in running.values()}
+                for step in self._dispatchable(running_ids, set(results), plan_ids):
+                    if self._set_status(step, "in_progress", step.status):
+                        running[pool.submit(execute, step)] = step
+                if not running:
+                    return results
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    try:
+                        results[step.plan_id] = future.result()
+                        status = "completed"
+                    except Exception as e:
+                        results[step.plan_id] = f"执行失败: {str(e)}"
+                        status = "failed"
+                    self._set_status(step, status, "in_progress")
+
+
+if __name__ == "__main__":
+    import threading
+    import time
+
+    from .plan_store import InMemoryPlanStore, Plan
+
+    # docs、scaffold_init 互不依赖；scaffold_deps 依赖 scaffold_init；impl 依赖 docs 和 scaffold（父步骤）
+    store = InMemoryPlanStore()
+    store.replace("demo", Plan([
+        PlanStep("plan_step_docs", "搜索文档"),
+        PlanStep("plan_step_scaffold", "搭建项目骨架"),
+        PlanStep("plan_step_scaffold_init", "初始化项目", parent_id="plan_step_scaffold"),
+        PlanStep("plan_step_scaffold_deps", "安装依赖", depends_on=["plan_step_scaffold_init"],
+                 parent_id="plan_step_scaffold"),
+        PlanStep("plan_step_impl", "实现功能", depends_on=["plan_step_docs", "plan_step_scaffold"]),
+        PlanStep("plan_step_broken", "会失败的步骤"),
+        PlanStep("plan_step_after_broken", "依赖失败步骤", depends_on=["plan_step_broken"]),
+    ]))
+
+    active, peak, order = 0, 0, []
+    counter_lock = threading.Lock()
+
+    def execute(step: PlanStep) -> str:
+        global active, peak
+        with counter_lock:
+            active += 1
+            peak = max(peak, active)
+            order.append(step.plan_id)
+        time.sleep(0.3)
+        with counter_lock:
+            active -= 1
+        if step.plan_id == "plan_step_broken":
+            raise RuntimeError("模拟失败")
+        return f"{step.task} 完成"
+
+    started = time.perf_counter()
+    results = PlanScheduler("demo", store).run(execute)
+    elapsed = time.perf_counter() - started
+    plan = store.load("demo")
+
+    assert set(results) == {"plan_step_docs", "plan_step_scaffold_init", "plan_step_scaffold_deps",
+                            "plan_step_impl", "plan_step_broken"}, results
+    assert order.index("plan_step_scaffold_deps") > order.index("plan_step_scaffold_init")
+    assert order[-1] == "plan_step_impl"
+    assert plan.get("plan_step_scaffold").status == "completed"
+    assert plan.get("plan_step_broken").status == "failed"
+    assert plan.get("plan_step_after_broken").status == "todo"
+    assert peak == 3, peak
+    # 5 个步骤串行需要 1.5s，按依赖并行只需关键路径上的 3 个步骤
+    assert elapsed < 1.2, elapsed
+    print(f"执行 {len(results)} 个步骤，最大并发 {peak}，耗时 {elapsed:.2f}s")
+
+    # 只调度指定的步骤
+    store.replace("partial", Plan.from_tasks(["a", "b", "c"]))
+    results = PlanScheduler("partial", store).run(lambda step: step.task, {"plan_step_1", "plan_step_2"})
+    assert list(results) == ["plan_step_1", "plan_step_2"], results
+    assert store.load("partial").ready_steps()[0].plan_id == "plan_step_3"
+    print("只调度指定步骤: 通过")
+
+    # 执行期间计划被清空或替换：已提交的步骤记录结果，不写入状态，也不会标记新计划中同 ID 的步骤
+    store.replace("replaced", Plan.from_tasks(["a", "b"]))
+
+    def replace_midway(step: PlanStep) -> str:
+        if step.plan_id == "plan_step_1":
+            with store.lock("replaced"):
+                store.replace("replaced", Plan.from_tasks(["x", "y"]))
+        return step.task
+
+    results = PlanScheduler("replaced", store).run(replace_midway, {"plan_step_1", "plan_step_2"})
+    assert results["plan_step_1"] == "a", results
+    assert store.load("replaced").get("plan_step_1").status == "todo"
+    print("执行期间替换计划: 通过")
@@ -0,0 +1,483 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+# 存储后端，可选 memory（默认，进程内）或 sqlite（持久化到 PLAN_STORE_PATH）
+PLAN_STORE_BACKEND = os.getenv("PLAN_STORE_BACKEND", "memory")
+PLAN_STORE_PATH = os.getenv("PLAN_STORE_PATH", "plans.db")
+# SQLite 后端在内存中缓存多少个会话的计划，超出后按 LRU 淘汰
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "256"))
+
+
+class PlanStep:
+    __slots__ = ("plan_id", "task", "status", "depends_on", "parent_id")
+
+    def __init__(self, plan_id: str, task: str, status: str = "todo",
+                 depends_on: list[str] | None = None, parent_id: str | None = None):
+        self.plan_id = plan_id
+        self.task = task
+        self.status = status
+        # 显式声明的前置步骤
+        self.depends_on = depends_on or []
+        # 所属的父步骤，顶层步骤为 None
+        self.parent_id = parent_id
+
+
+class Plan:
+    """
+    一个会话的计划：步骤之间的依赖构成有向无环图，步骤可以包含子步骤。
+
+    每个步骤的实际前置条件 = 显式依赖 + 父步骤的依赖（子步骤不能早于父步骤开始）
+    + 自己的全部子步骤（父步骤在子步骤都完成后才算完成）。
+
+    为每个步骤维护"尚未完成的前置步骤数"，计数为 0 且自身未完成的步骤构成就绪集合：
+    - 更新校验只需查看计数，不需要扫描其他步骤；
+    - 步骤完成或重新打开时，只调整直接依赖它的步骤的计数；
+    - 就绪集合中的步骤互不依赖，可以并行执行。
+    init_planning 创建的线性计划就是每一步依赖上一步的链，就绪集合始终只有一个步骤。
+    """
+
+    def __init__(self, steps: list[PlanStep]):
+        self.steps = steps
+        self._positions: dict[str, int] = {}
+        for i, step in enumerate(steps):
+            if step.plan_id in self._positions:
+                raise ValueError(f"步骤 ID 重复: {step.plan_id}")
+            self._positions[step.plan_id] = i
+
+        children: dict[str, list[str]] = {}
+        for step in steps:
+            for dep in step.depends_on + ([step.parent_id] if step.parent_id else []):
+                if dep not in self._positions:
+                    raise ValueError(f"步骤 {step.plan_id} 引用了不存在的步骤: {dep}")
+            if step.parent_id:
+                children.setdefault(step.parent_id, []).append(step.plan_id)
+        self._children = children
+
+        self._requires = {step.plan_id: self._inherited_deps(step) + children.get(step.plan_id, [])
+                          for step in steps}
+        self._dependents: dict[str, list[str]] = {step.plan_id: [] for step in steps}
+        for plan_id, requires in self._requires.items():
+            for dep in requires:
+                self._dependents[dep].append(plan_id)
+        self._check_acyclic()
+
+        self._pending = {
+            plan_id: sum(self.get(dep).status != "completed" for dep in requires)
+            for plan_id, requires in self._requires.items()
+        }
+        self._ready = {
+            step.plan_id for step in steps
+            if step.status != "completed" and self._pending[step.plan_id] == 0
+        }
+        self._completed = sum(step.status == "completed" for step in steps)
+        # 线性计划沿用"唯一当前任务"的展示方式，不显示依赖关系
+        self.sequential = all(
+            step.parent_id is None and step.depends_on == ([steps[i - 1].plan_id] if i else [])
+            for i, step in enumerate(steps)
+        )
+
+    @classmethod
+    def from_tasks(cls, tasks: list[str]) -> "Plan":
+        """线性计划：每一步依赖上一步"""
+        steps = []
+        for i, task in enumerate(tasks, 1):
+            steps.append(PlanStep(f"plan_step_{i}", task, depends_on=[f"plan_step_{i - 1}"] if i > 1 else []))
+        return cls(steps)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def _inherited_deps(self, step: PlanStep) -> list[str]:
+        deps, parent_id, seen = list(step.depends_on), step.parent_id, set()
+        while parent_id:
+            if parent_id in seen:
+                raise ValueError(f"步骤 {step.plan_id} 的父子关系存在循环")
+            seen.add(parent_id)
+            parent = self.get(parent_id)
+            deps.extend(parent.depends_on)
+            parent_id = parent.parent_id
+        return list(dict.fromkeys(deps))
+
+    def _check_acyclic(self) -> None:
+        indegree = {plan_id: len(requires) for plan_id, requires in self._requires.items()}
+        queue = [plan_id for plan_id, n in indegree.items() if n == 0]
+        visited = 0
+        while queue:
+            plan_id = queue.pop()
+            visited += 1
+            for dependent in self._dependents[plan_id]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    queue.append(dependent)
+        if visited != len(self.steps):
+            cycle = sorted(plan_id for plan_id, n in indegree.items() if n > 0)
+            raise ValueError(f"步骤之间存在循环依赖: {', '.join(cycle)}")
+
+    def get(self, plan_id: str) -> PlanStep | None:
+        position = self._positions.get(plan_id)
+        return None if position is None else self.steps[position]
+
+    def depth(self, step: PlanStep) -> int:
+        depth, parent_id = 0, step.parent_id
+        while parent_id:
+            depth += 1
+            parent_id = self.get(parent_id).parent_id
+        return depth
+
+    def has_children(self, plan_id: str) -> bool:
+        return plan_id in self._children
+
+    def all_completed(self) -> bool:
+        return self._completed == len(self.steps)
+
+    def ready_steps(self) -> list[PlanStep]:
+        """所有前置条件都已完成、自身尚未完成的步骤，按计划顺序排列"""
+        return [self.steps[i] for i in sorted(self._positions[plan_id] for plan_id in self._ready)]
+
+    def blocker(self, plan_id: str) -> PlanStep | None:
+        """返回阻止更新该步骤的一个未完成前置步骤，可以更新时返回 None"""
+        if self._pending[plan_id] == 0:
+            return None
+        return next(self.get(dep) for dep in self._requires[plan_id] if self.get(dep).status != "completed")
+
+    def set_status(self, plan_id: str, status: str) -> list[str]:
+        """
+        更新步骤状态并维护就绪集合，返回因此被连带修改状态的父步骤 ID：
+        最后一个子步骤完成时父步骤自动完成，子步骤重新打开时已完成的父步骤回到 in_progress。
+        """
+        step = self.get(plan_id)
+        was_completed, step.status = step.status == "completed", status
+        now_completed = status == "completed"
+        cascaded = []
+        if now_completed and not was_completed:
+            self._completed += 1
+            self._ready.discard(plan_id)
+            for dependent in self._dependents[plan_id]:
+                self._pending[dependent] -= 1
+                if self._pending[dependent] == 0 and self.get(dependent).status != "completed":
+                    self._ready.add(dependent)
+            parent_id = step.parent_id
+            if parent_id and self._pending[parent_id] == 0 and self.get(parent_id).status != "completed":
+                cascaded = [parent_id] + self.set_status(parent_id, "completed")
+        elif was_completed and not now_completed:
+            self._completed -= 1
+            if self._pending[plan_id] == 0:
+                self._ready.add(plan_id)
+            for dependent in self._dependents[plan_id]:
+                self._pending[dependent] += 1
+                self._ready.discard(dependent)
+            parent_id = step.parent_id
+            if parent_id and self.get(parent_id).status == "completed":
+                cascaded = [parent_id] + self.set_status(parent_id, "in_progress")
+        return cascaded
+
+    def render(self) -> str:
+        """一次遍历生成完整的计划清单"""
+        lines = ["--- 执行计划清单 ---"]
+        for step in self.steps:
+            prefix, suffix = "[ ]", ""
+            if step.status == "completed":
+                prefix = "[DONE]"
+            elif step.plan_id in self._ready:
+                prefix = "[ACTIVE ->]"  # 特别强调
+                if self.sequential:
+                    suffix = " <-- 这是你当前唯一需要关注和执行的任务"
+                else:
+                    suffix = " <-- 依赖已全部完成，可以执行"
+            deps = "" if self.sequential or not step.depends_on else f" | 依赖: {', '.join(step.depends_on)}"
+            indent = "  " * self.depth(step)
+            lines.append(f"{indent}{prefix} ID: {step.plan_id} | 任务: {step.task} | 状态: {step.status}{deps}{suffix}")
+        if self.all_completed():
+            lines.append("\n提示：所有任务已完成或没有待办任务。")
+        elif len(self._ready) > 1:
+            ready = ", ".join(step.plan_id for step in self.ready_steps())
+            lines.append(f"\n提示：{ready} 互不依赖，可以在同一轮中并行调用工具执行。")
+        return "\n".join(lines)
+
+
+class PlanStore(ABC):
+    """
+    计划存储：按会话（LangGraph 的 thread_id）隔离，每个会话一份独立的有序步骤表。
+
+    读-校验-写需要在 lock(session_id) 内完成。锁按会话划分，
+    不同会话之间互不阻塞，只有获取锁对象的一瞬间会用到全局锁。
+    """
+
+    def __init__(self):
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def lock(self, session_id: str) -> threading.Lock:
+        with self._locks_guard:
+            lock = self._locks.get(session_id)
+            if lock is None:
+                lock = self._locks[session_id] = threading.Lock()
+            return lock
+
+    @abstractmethod
+    def load(self, session_id: str) -> Plan | None:
+        """读取会话的计划，没有计划时返回 None"""
+
+    @abstractmethod
+    def replace(self, session_id: str, plan: Plan) -> None:
+        """用新的计划整体替换会话原有的计划"""
+
+    @abstractmethod
+    def save_status(self, session_id: str, plan: Plan, plan_ids: list[str]) -> None:
+        """持久化 plan.set_status 对这些步骤所做的状态修改（包括被连带修改的父步骤）"""
+
+
+class InMemoryPlanStore(PlanStore):
+    """进程内存储，进程重启后计划丢失，适合本地调试"""
+
+    def __init__(self):
+        super().__init__()
+        self._plans: dict[str, Plan] = {}
+
+    def load(self, session_id: str) -> Plan | None:
+        # 直接返回内部对象，调用方在会话锁内使用，修改即时生效
+        return self._plans.get(session_id)
+
+    def replace(self, session_id: str, plan: Plan) -> None:
+        self._plans[session_id] = plan
+
+    def save_status(self, session_id: str, plan: Plan, plan_ids: list[str]) -> None:
+        pass
+
+
+class SQLitePlanStore(PlanStore):
+    """
+    SQLite 存储，计划在进程重启后依然保留，多个 worker 进程可以共享同一个数据库文件。
+
+    - 使用 WAL 模式：读不阻塞写，写入在提交后即可抵御进程崩溃；
+    - 每个线程使用自己的连接，避免在线程之间共享连接时的串行化；
+    - 创建计划时在一个事务内用 executemany 批量写入所有步骤；
+    - 每个会话有一个版本号，每次写入时在同一事务内递增。解析好的 Plan 按会话缓存，
+      读取时只查一次版本号，与缓存一致（没有其他进程写入过）时直接返回缓存，
+      因此更新步骤的开销与计划长度无关。写入时如果发现读取之后有其他进程写入过，丢弃缓存重新读取。
+    """
+
+    def __init__(self, path: str = PLAN_STORE_PATH, cache_size: int = PLAN_CACHE_SIZE):
+        super().__init__()
+        self.path = path
+        self.cache_size = cache_size
+        self._local = threading.local()
+        # session_id -> (版本号, Plan)
+        self._cache: OrderedDict[str, tuple[int | None, Plan]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS plan_steps (
+                    session_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    plan_id TEXT NOT NULL,
+                    task TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    PRIMARY KEY (session_id, plan_id)
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS plan_steps_order ON plan_steps (session_id, position)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS plan_versions (session_id TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+            # 兼容旧版本创建的、还没有依赖关系字段的数据库
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(plan_steps)")}
+            if "depends_on" not in columns:
+                conn.execute("ALTER TABLE plan_steps ADD COLUMN depends_on TEXT NOT NULL DEFAULT '[]'")
+                conn.execute("ALTER TABLE plan_steps ADD COLUMN parent_id TEXT")
+                # 旧版本的计划都是线性的：每一步依赖上一步
+                conn.execute(
+                    """
+                    UPDATE plan_steps SET depends_on = (
+                        SELECT json_array(prev.plan_id) FROM plan_steps AS prev
+                        WHERE prev.session_id = plan_steps.session_id AND prev.position = plan_steps.position - 1
+                    )
+                    WHERE position > 0
+                    """
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None 关闭隐式事务，由 _transaction 显式控制
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 模式下 NORMAL 已能保证崩溃后数据库一致，且提交时不必每次 fsync
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connect()
+        # IMMEDIATE 在事务开始时就获取写锁，避免多个进程同时升级读锁导致死锁
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _version(conn: sqlite3.Connection, session_id: str) -> int | None:
+        row = conn.execute("SELECT version FROM plan_versions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection, session_id: str) -> int:
+        conn.execute(
+            "INSERT INTO plan_versions (session_id, version) VALUES (?, 1) "
+            "ON CONFLICT (session_id) DO UPDATE SET version = version + 1",
+            (session_id,),
+        )
+        return SQLitePlanStore._version(conn, session_id)
+
+    def _cache_put(self, session_id: str, version: int | None, plan: Plan) -> None:
+        with self._cache_lock:
+            self._cache[session_id] = (version, plan)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, session_id: str) -> None:
+        with self._cache_lock:
+            self._cache.pop(session_id, None)
+
+    def load(self, session_id: str) -> Plan | None:
+        conn = self._connect()
+        version = self._version(conn, session_id)
+        with self._cache_lock:
+            cached = self._cache.get(session_id)
+            if cached is not None and cached[0] == version:
+                self._cache.move_to_end(session_id)
+                # 与 InMemoryPlanStore 一样返回缓存的对象，调用方在会话锁内修改后通过 save_status 写回
+                return cached[1]
+
+        rows = conn.execute(
+            "SELECT plan_id, task, status, depends_on, parent_id FROM plan_steps "
+            "WHERE session_id = ? ORDER BY position",
+            (session_id,),
+        )
+        steps = [
+            PlanStep(plan_id, task, status, json.loads(depends_on), parent_id)
+            for plan_id, task, status, depends_on, parent_id in rows
+        ]
+        if not steps:
+            self._cache_drop(session_id)
+            return None
+        plan = Plan(steps)
+        self._cache_put(session_id, version, plan)
+        return plan
+
+    def replace(self, session_id: str, plan: Plan) -> None:
+        try:
+            with self._transaction() as conn:
+                version = self._write_plan(conn, session_id, plan)
+        except BaseException:
+            self._cache_drop(session_id)
+            raise
+        self._cache_put(session_id, version, plan)
+
+    def _write_plan(self, conn: sqlite3.Connection, session_id: str, plan: Plan) -> int:
+        conn.execute("DELETE FROM plan_steps WHERE session_id = ?", (session_id,))
+        conn.executemany(
+            "INSERT INTO plan_steps (session_id, position, plan_id, task, status, depends_on, parent_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (session_id, position, step.plan_id, step.task, step.status,
+                 json.dumps(step.depends_on), step.parent_id)
+                for position, step in enumerate(plan.steps)
+            ],
+        )
+        return self._bump_version(conn, session_id)
+
+    def save_status(self, session_id: str, plan: Plan, plan_ids: list[str]) -> None:
+        try:
+            with self._transaction() as conn:
+                # 写锁内读取写入前的版本号，用来判断 plan 读出之后是否有其他进程写入过
+                current = self._version(conn, session_id)
+                conn.executemany(
+                    "UPDATE plan_steps SET status = ? WHERE session_id = ? AND plan_id = ?",
+                    [(plan.get(plan_id).status, session_id, plan_id) for plan_id in plan_ids],
+                )
+                version = self._bump_version(conn, session_id)
+        except BaseException:
+            # 内存中的计划已经修改但没有写入，丢弃缓存，下次从数据库重新读取
+            self._cache_drop(session_id)
+            raise
+        with self._cache_lock:
+            cached = self._cache.get(session_id)
+            fresh = cached is not None and cached[1] is plan and cached[0] == current
+        if fresh:
+            self._cache_put(session_id, version, plan)
+        else:
+            # plan 不是按 current 版本读出的，其余步骤可能已被其他进程修改，不能当作新版本缓存
+            self._cache_drop(session_id)
+
+
+_store: PlanStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_plan_store() -> PlanStore:
+    """按环境变量 PLAN_STORE_BACKEND 创建全局共享的计划存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if PLAN_STORE_BACKEND == "sqlite":
+                _store = SQLitePlanStore(PLAN_STORE_PATH)
+            elif PLAN_STORE_BACKEND == "memory":
+                _store = InMemoryPlanStore()
+            else:
+                raise ValueError(f"未知的 PLAN_STORE_BACKEND: {PLAN_STORE_BACKEND}，可选值: memory, sqlite")
+        return _store
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    # 两个实例共享同一个数据库文件，模拟两个 worker 进程
+    first, second = SQLitePlanStore(path), SQLitePlanStore(path)
+
+    first.replace("demo", Plan.from_tasks([f"步骤 {i}" for i in range(2000)]))
+    started = time.perf_counter()
+    for i in range(1, 2001):
+        plan = first.load("demo")
+        plan_id = f"plan_step_{i}"
+        first.save_status("demo", plan, [plan_id] + plan.set_status(plan_id, "completed"))
+    elapsed = time.perf_counter() - started
+    assert first.load("demo").all_completed()
+    assert first.load("demo") is first.load("demo")
+    print(f"2000 次状态更新耗时 {elapsed:.2f}s")
+
+    # 另一个实例的写入使版本号变化，first 重新读取
+    plan = second.load("demo")
+    second.save_status("demo", plan, ["plan_step_1"] + plan.set_status("plan_step_1", "todo"))
+    assert first.load("demo").get("plan_step_1").status == "todo"
+
+    # first 读取后 second 写入，first 再基于旧的 plan 写入：不能把旧 plan 缓存为最新版本
+    first.replace("race", Plan.from_tasks(["a", "b"]))
+    stale = first.load("race")
+    plan = second.load("race")
+    second.save_status("race", plan, ["plan_step_1"] + plan.set_status("plan_step_1", "completed"))
+    first.save_status("race", stale, ["plan_step_2"] + stale.set_status("plan_step_2", "in_progress"))
+    reloaded = first.load("race")
+    assert reloaded is not stale
+    assert reloaded.get("plan_step_1").status == "completed", reloaded.get("plan_step_1").status
+    assert reloaded.get("plan_step_2").status == "in_progress"
+    print("两个实例交错写入: 通过")
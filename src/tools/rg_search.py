@@ -1,33 +1,339 @@
 import json
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 from langchain_core.tools import tool
 
+from .file_cache import file_cache
+from .trigram_index import iter_indexed_matches
+
+
+Match = tuple[str, int, str]
+
+
+def _parse_match(line: bytes) -> Match | None:
+    """解析 rg --json 的一行输出，只保留 match 记录"""
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    if record.get("type") != "match":
+        return None
+
+    d = record["data"]
+    p = d["path"].get("text")
+    text = d["lines"].get("text")
+    # 非 UTF-8 的路径或内容会以 bytes 字段给出，这里直接跳过
+    if p is None or text is None:
+        return None
+    return p, d["line_number"], text.rstrip("\n")
+
+
+def _iter_rg(query: str, file_path: str, sort_by_path: bool = False) -> Iterator[Match]:
+    """
+    以流的方式逐行读取 rg --json 的输出，边解析边产出匹配。
+
+    调用方停止迭代（或关闭生成器）时会立即结束 rg 进程，不再继续扫描。
+    rg 退出码 1 表示没有匹配；退出码 2 等表示出错，抛出 CalledProcessError。
+    """
+    cmd = ["rg", "--json"]
+    if sort_by_path:
+        # 按路径顺序输出，分页结果在多次调用之间保持稳定（代价是 rg 改为单线程遍历）
+        cmd += ["--sort", "path"]
+    cmd += ["-e", query, file_path]
+
+    # stderr 写入临时文件，避免管道写满阻塞 rg
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        finished = False
+        try:
+            for line in proc.stdout:
+                match = _parse_match(line)
+                if match is not None:
+                    yield match
+            finished = True
+        finally:
+            if not finished:
+                proc.kill()
+            proc.stdout.close()
+            returncode = proc.wait()
+
+        if returncode not in (0, 1):
+            err.seek(0)
+            raise subprocess.CalledProcessError(
+                returncode, cmd, stderr=err.read().decode("utf-8", errors="replace")
+            )
+
+
+def _iter_matches(
+    query: str,
+    file_path: str,
+    sort_by_path: bool = False,
+    use_index: bool = False,
+) -> Iterator[Match]:
+    """
+    统一的搜索入口：默认调用 rg；指定 use_index 或本机没有安装 rg 时，
+    改用内置的三元组索引（纯 Python 实现，结果同样按路径 + 行号排序）。
+    """
+    if use_index or shutil.which("rg") is None:
+        return iter_indexed_matches(query, file_path)
+    return _iter_rg(query, file_path, sort_by_path=sort_by_path)
+
+
+def _run_rg(query: str, file_path: str, use_index: bool = False) -> list[Match]:
+    """完整执行一次搜索，返回按路径 + 行号排序的全部匹配"""
+    all_matches = list(_iter_matches(query, file_path, use_index=use_index))
+    all_matches.sort(key=lambda x: (x[0], x[1]))
+    return all_matches
+
+
+# 批量搜索时并发运行的 rg 进程数上限
+_MAX_BATCH_WORKERS = 8
+
+# 搜索游标的存活时间（秒）与最大数量，超出后按 LRU 关闭
+_CURSOR_TTL = 300
+_MAX_CURSORS = 16
+# 每个游标最多缓存多少条已读取的匹配，超出后丢弃最早的部分
+_CURSOR_BUFFER_SIZE = 5000
+
+
+class _CursorClosed(Exception):
+    """游标在取出之后、翻页之前被淘汰，输出流已经关闭，需要新建游标重新搜索"""
+
+
+class _SearchCursor:
+    """
+    一次文件或目录搜索的游标：保存已读取的匹配和尚未读完的 rg 输出流。
+
+    rg 进程在管道写满后会自然阻塞，相当于被挂起；翻页时从流中继续读取即可，
+    不需要重新扫描。已读到的文件会记录 (mtime, size)，任何一个发生变化时游标失效。
+    """
+
+    def __init__(self, query: str, file_path: str, use_index: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.file_path = file_path
+        self.use_index = use_index
+        self.buffer: list[Match] = []
+        self.base = 0  # buffer[0] 对应的匹配序号
+        self.exhausted = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = False
+        self._stream_closed = False
+        self._stream = _iter_matches(query, file_path, sort_by_path=True, use_index=use_index)
+        self._fingerprints: dict[str, tuple[int, int]] = {}
+
+    def _fill(self, upto: int) -> None:
+        """从 rg 输出流继续读取，直到已读取 upto 条匹配或流结束"""
+        while not self.exhausted and self.base + len(self.buffer) < upto:
+            match = next(self._stream, None)
+            if match is None:
+                self.exhausted = True
+                break
+            self.buffer.append(match)
+            if match[0] not in self._fingerprints:
+                try:
+                    st = os.stat(match[0])
+                    self._fingerprints[match[0]] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    self._fingerprints[match[0]] = (-1, -1)
+
+        overflow = len(self.buffer) - _CURSOR_BUFFER_SIZE
+        if overflow > 0:
+            del self.buffer[:overflow]
+            self.base += overflow
+
+    def is_stale(self) -> bool:
+        """已读到的文件中有任何一个被修改或删除，则游标失效"""
+        # 其他线程翻页时会在锁内新增记录，这里遍历锁内取得的快照
+        with self.lock:
+            fingerprints = list(self._fingerprints.items())
+        for path, fingerprint in fingerprints:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return True
+            if (st.st_mtime_ns, st.st_size) != fingerprint:
+                return True
+        return False
+
+    def complete_results(self) -> list[Match] | None:
+        """搜索已经结束且没有丢弃过任何匹配时返回全部结果，否则返回 None"""
+        with self.lock:
+            if self.exhausted and self.base == 0:
+                return list(self.buffer)
+        return None
+
+    def can_serve(self, offset: int) -> bool:
+        return offset >= self.base
+
+    def page(self, offset: int, limit: int) -> tuple[list[Match], bool, int | None]:
+        """返回 (本页结果, 是否还有更多, 总数或 None)；输出流已被关闭时抛出 _CursorClosed"""
+        with self.lock:
+            if self._stream_closed and not self.exhausted:
+                # 继续读取已关闭的生成器只会得到一个被截断的结果
+                raise _CursorClosed
+            self.last_used = time.monotonic()
+            # 多读一条用于判断是否还有下一页
+            self._fill(offset + limit + 1)
+            start = offset - self.base
+            paged = self.buffer[start : start + limit]
+            end = self.base + len(self.buffer)
+            has_more = end > offset + limit
+            total = end if self.exhausted else None
+        # 翻页期间游标被淘汰时，由翻页的线程在读完本页后关闭输出流
+        self._close_if_idle()
+        return paged, has_more, total
+
+    def close(self) -> None:
+        """
+        关闭 rg 输出流。其他线程正在翻页时只做标记，不能在它读取的同时关闭生成器，
+        由它读完本页后关闭。
+        """
+        self.closed = True
+        self._close_if_idle()
+
+    def _close_if_idle(self) -> None:
+        if self.closed and self.lock.acquire(blocking=False):
+            try:
+                self._stream_closed = True
+                self._stream.close()
+            finally:
+                self.lock.release()
+
+
+_cursors: OrderedDict[str, _SearchCursor] = OrderedDict()
+_cursors_lock = threading.Lock()
+
+
+def _drop_cursor(cursor: _SearchCursor) -> None:
+    with _cursors_lock:
+        _cursors.pop(cursor.id, None)
+    cursor.close()
+
+
+def _take_cursor(
+    cursor_id: str | None,
+    query: str,
+    file_path: str,
+    offset: int,
+    use_index: bool = False,
+) -> _SearchCursor:
+    """
+    取出可以继续使用的游标；游标不存在、已过期、参数不一致、文件已变化，
+    或请求的 offset 已被丢弃时，新建一个游标从头搜索。
+    """
+    now = time.monotonic()
+    expired = []
+    with _cursors_lock:
+        for cid, c in list(_cursors.items()):
+            if now - c.last_used > _CURSOR_TTL:
+                expired.append(_cursors.pop(cid))
+        cursor = _cursors.get(cursor_id) if cursor_id else None
+    for c in expired:
+        c.close()
+
+    if cursor is not None and (
+        cursor.query != query
+        or cursor.file_path != file_path
+        or cursor.use_index != use_index
+        or not cursor.can_serve(offset)
+        or cursor.is_stale()
+    ):
+        _drop_cursor(cursor)
+        cursor = None
+
+    if cursor is None:
+        cursor = _SearchCursor(query, file_path, use_index)
+        evicted = []
+        with _cursors_lock:
+            _cursors[cursor.id] = cursor
+            while len(_cursors) > _MAX_CURSORS:
+                evicted.append(_cursors.popitem(last=False)[1])
+        for c in evicted:
+            c.close()
+    else:
+        with _cursors_lock:
+            _cursors.move_to_end(cursor.id)
+    return cursor
+
+
+def _page_cursor(
+    cursor_id: str | None,
+    query: str,
+    file_path: str,
+    offset: int,
+    limit: int,
+    use_index: bool = False,
+) -> tuple[_SearchCursor, list[Match], bool, int | None]:
+    """通过游标读取一页，返回 (游标, 本页结果, 是否还有更多, 总数或 None)"""
+    while True:
+        search = _take_cursor(cursor_id, query, file_path, offset, use_index)
+        try:
+            return (search, *search.page(offset, limit))
+        except _CursorClosed:
+            cursor_id = None
+        except BaseException:
+            _drop_cursor(search)
+            raise
+
+
+def _cache_matches(file_path: str, query: str, matches: list[Match], st: os.stat_result) -> None:
+    """缓存单个文件的完整搜索结果，超出 file_cache 单条预算的结果不会被缓存"""
+    cost = sum(len(p) + len(text) + 64 for p, _, text in matches) + 64
+    file_cache.put(file_path, ("rg", query), matches, cost, st)
+
 
 @tool
 def ripgrep_search_with_paging(
     file_path: str,
     query: str,
     offset: int = 0,
-    limit: int | None = 50
+    limit: int | None = 50,
+    count_total: bool = False,
+    cursor: str | None = None,
+    use_index: bool = False,
 ) -> str:
     """
     使用 ripgrep 搜索并返回分页信息 + 匹配列表。
 
+    默认以流式方式读取 rg 的输出，收集到 offset + limit 条匹配后立即停止搜索，
+    耗时和内存只与页大小有关。此时如果搜索被提前终止，total_matches 为 null，
+    是否还有下一页请看 has_more。
+
+    还有下一页时会返回 cursor。翻页时把 cursor 连同新的 offset 一起传回，
+    会从上次停下的位置继续读取，而不是重新搜索。游标在文件被修改或闲置超时后自动失效，
+    失效时会透明地重新搜索。
+
     Args:
         file_path:  要搜索的文件或目录路径
         query:      搜索字符串或正则表达式
         offset:     跳过前 offset 条
         limit:      最多返回 limit 条
+        count_total: 为 True 时完整搜索一遍以统计匹配总数（大目录上较慢）
+        cursor:     上一页返回的游标 ID，用于继续翻页
+        use_index:  为 True 时使用内置的三元组索引搜索目录。索引首次建立后常驻内存，
+                    并按文件修改时间增量更新，适合对同一个仓库反复搜索。
+                    本机未安装 rg 时会自动使用索引。
 
     Returns:
         JSON 字符串，包含:
           - offset
           - limit
-          - total_matches
+          - total_matches (int 或 null)
           - returned_count
           - has_more (bool)
+          - cursor (str 或 null，翻页时传回)
           - results (list of "path:line:content")
     """
 
@@ -37,40 +343,43 @@ def ripgrep_search_with_paging(
             "error": f"路径不存在: {file_path}"
         })
 
-    # 调用 ripgrep 输出 JSON
-    cmd = ["rg", "--json", query, file_path]
+    offset = max(0, offset)
+    # 单个文件的完整搜索结果按 (路径, mtime, size, 查询) 缓存，文件未变化时直接复用
+    st = os.stat(file_path) if os.path.isfile(file_path) else None
     try:
-        proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        all_matches = file_cache.get(file_path, ("rg", query), st) if st is not None else None
+        if all_matches is None and (count_total or limit is None):
+            all_matches = _run_rg(query, file_path, use_index=use_index)
+            if st is not None:
+                _cache_matches(file_path, query, all_matches, st)
+        elif all_matches is None:
+            # 文件和目录都以流的方式读取，大文件中的海量匹配不会被一次性读入内存
+            search, paged, has_more, total = _page_cursor(cursor, query, file_path, offset, limit, use_index)
+            # 没有下一页时立即释放游标和 rg 进程
+            if not has_more:
+                _drop_cursor(search)
+                # 只有游标缓冲区放得下全部匹配时才缓存
+                complete = search.complete_results() if st is not None else None
+                if complete is not None:
+                    _cache_matches(file_path, query, complete, st)
     except subprocess.CalledProcessError as e:
         return json.dumps({
             "error": "rg 执行失败",
             "details": e.stderr.strip()
         })
-
-    # 解析 JSON 输出
-    all_matches = []
-    for line in proc.stdout.splitlines():
-        try:
-            record = json.loads(line)
-        except json.JSONDecodeError:
-            continue
-        if record.get("type") != "match":
-            continue
-
-        d = record["data"]
-        p = d["path"]["text"]
-        ln = d["line_number"]
-        text = d["lines"]["text"].rstrip("\n")
-        all_matches.append((p, ln, text))
-
-    # 按路径 + 行号排序
-    all_matches.sort(key=lambda x: (x[0], x[1]))
+    except FileNotFoundError:
+        return json.dumps({
+            "error": "未找到 rg 命令，请先安装 ripgrep"
+        })
 
     # 计算分页
-    total = len(all_matches)
-    paged = all_matches[offset : offset + limit] if limit is not None else all_matches[offset:]
-    returned = len(paged)
-    has_more = (offset + returned) < total
+    if all_matches is not None:
+        total = len(all_matches)
+        paged = all_matches[offset : offset + limit] if limit is not None else all_matches[offset:]
+        returned = len(paged)
+        has_more = (offset + returned) < total
+    else:
+        returned = len(paged)
 
     # 结果结构
     response = {
@@ -79,10 +388,90 @@ def ripgrep_search_with_paging(
         "total_matches": total,
         "returned_count": returned,
         "has_more": has_more,
+        "cursor": search.id if all_matches is None and has_more else None,
         "results": [f"{p}:{ln}:{txt}" for p, ln, txt in paged]
     }
 
     return json.dumps(response, ensure_ascii=False, indent=2)
 
+def _search_job(query: str, root: str, limit: int) -> tuple[list[Match], bool]:
+    """批量搜索中的单个任务：流式读取前 limit + 1 条匹配后终止 rg"""
+    stream = _iter_matches(query, root, sort_by_path=True)
+    try:
+        window = list(islice(stream, limit + 1))
+    finally:
+        stream.close()
+    return window[:limit], len(window) > limit
+
+
+@tool
+def ripgrep_batch_search(
+    queries: list[str],
+    paths: list[str],
+    limit_per_query: int = 50,
+    max_workers: int = 4,
+) -> str:
+    """
+    一次调用同时搜索多个关键字 / 正则，覆盖多个文件或目录。
+
+    使用场景：需要查找多个标识符（例如多个函数名、类名）的定义或引用时，
+    优先使用这个工具，而不是多次调用 ripgrep_search_with_paging。
+    所有 (query, path) 组合会并发执行，总耗时接近单次搜索。
+
+    Args:
+        queries:         搜索字符串或正则表达式列表
+        paths:           要搜索的文件或目录路径列表
+        limit_per_query: 每个 query 最多返回的匹配条数
+        max_workers:     最多同时运行的 rg 进程数（上限 8）
+
+    Returns:
+        JSON 字符串，按 query 分组，每组包含:
+          - returned_count
+          - has_more (bool)：是否还有更多结果，可用 ripgrep_search_with_paging 继续翻页
+          - results (list of "path:line:content")，已去重并按路径 + 行号排序
+          - errors (list)：执行失败的路径及原因
+    """
+    missing = [p for p in paths if not os.path.exists(p)]
+    roots = [p for p in paths if os.path.exists(p)]
+    queries = list(dict.fromkeys(queries))
+    limit = max(1, limit_per_query)
+
+    jobs = [(q, root) for q in queries for root in roots]
+    workers = max(1, min(max_workers, _MAX_BATCH_WORKERS, len(jobs) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(q, root, pool.submit(_search_job, q, root, limit)) for q, root in jobs]
+
+        grouped: dict[str, dict] = {}
+        for q in queries:
+            grouped[q] = {"matches": {}, "has_more": False, "errors": []}
+        for q, root, future in futures:
+            group = grouped[q]
+            try:
+                matches, more = future.result()
+            except subprocess.CalledProcessError as e:
+                group["errors"].append({"path": root, "error": "rg 执行失败", "details": e.stderr.strip()})
+                continue
+            except FileNotFoundError:
+                group["errors"].append({"path": root, "error": "未找到 rg 命令，请先安装 ripgrep"})
+                continue
+            group["has_more"] = group["has_more"] or more
+            # 多个路径互相包含时会搜到同一行，按规范化后的 (路径, 行号) 去重
+            for p, ln, text in matches:
+                group["matches"].setdefault((os.path.normpath(p), ln), text)
+
+    response: dict = {"results": {}}
+    for q, group in grouped.items():
+        merged = sorted(group["matches"].items())
+        response["results"][q] = {
+            "returned_count": min(len(merged), limit),
+            "has_more": group["has_more"] or len(merged) > limit,
+            "results": [f"{p}:{ln}:{txt}" for (p, ln), txt in merged[:limit]],
+            "errors": group["errors"],
+        }
+    if missing:
+        response["missing_paths"] = missing
+
+    return json.dumps(response, ensure_ascii=False, indent=2)
+
 if __name__ == "__main__":
     print(ripgrep_search_with_paging("C:/me", "flowerwine"))
\ No newline at end of file
@@ -0,0 +1,573 @@
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from dotenv import load_dotenv
+
+from .executors import Execution, ExecutionError, Logs
+
+load_dotenv()
+
+# 沙箱后端，可选 e2b（默认，云端沙箱）或 local（本地子进程，用于离线开发和测试）
+SANDBOX_BACKEND = os.getenv("SANDBOX_BACKEND", "e2b")
+# 池中始终保持的预热（未分配）沙箱数量
+SANDBOX_MIN_WARM = int(os.getenv("SANDBOX_MIN_WARM", "1"))
+# 池中沙箱总数上限（预热 + 已分配 + 创建中）
+SANDBOX_MAX_SIZE = int(os.getenv("SANDBOX_MAX_SIZE", "8"))
+# 会话的沙箱闲置超过该秒数后被回收
+SANDBOX_IDLE_TIMEOUT = float(os.getenv("SANDBOX_IDLE_TIMEOUT", "900"))
+# 后台健康检查与补充预热沙箱的间隔秒数
+SANDBOX_CHECK_INTERVAL = float(os.getenv("SANDBOX_CHECK_INTERVAL", "30"))
+# 池已满时 acquire 最多等待的秒数
+SANDBOX_ACQUIRE_TIMEOUT = float(os.getenv("SANDBOX_ACQUIRE_TIMEOUT", "120"))
+# 每次续租给沙箱的存活秒数（E2B 的 timeout）
+SANDBOX_LEASE_SECONDS = int(os.getenv("SANDBOX_LEASE_SECONDS", "600"))
+# 剩余存活时间少于该秒数时由后台线程续租，应大于 SANDBOX_CHECK_INTERVAL
+SANDBOX_RENEW_MARGIN = float(os.getenv("SANDBOX_RENEW_MARGIN", "180"))
+
+
+class _CommandResult:
+    __slots__ = ("stdout", "stderr", "exit_code")
+
+    def __init__(self, stdout: str, stderr: str, exit_code: int):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_code = exit_code
+
+
+class CommandExitError(Exception):
+    """命令以非零状态退出，与 e2b 的 CommandExitException 一样携带 stdout / stderr / exit_code"""
+
+    def __init__(self, result: _CommandResult):
+        super().__init__(f"命令退出码 {result.exit_code}: {result.stderr.strip()}")
+        self.stdout = result.stdout
+        self.stderr = result.stderr
+        self.exit_code = result.exit_code
+
+
+# 流式读取本地沙箱文件时每次产出的字节数
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# 在子进程中执行代码的引导脚本：代码从 stdin 读入，异常信息以 JSON 写入 argv[1]
+_RUNNER = """
+import json, sys, traceback
+code = sys.stdin.read()
+try:
+    exec(compile(code, "<code>", "exec"), {"__name__": "__main__"})
+except BaseException as e:
+    with open(sys.argv[1], "w") as f:
+        json.dump({"name": type(e).__name__, "value": str(e), "traceback": traceback.format_exc()}, f)
+    sys.exit(1)
+"""
+
+
+class _OutputMessage:
+    """一行输出，与 e2b 的 OutputMessage 一样通过 line 访问内容"""
+    __slots__ = ("line", "error")
+
+    def __init__(self, line: str, error: bool):
+        self.line = line
+        self.error = error
+
+
+def _pump_lines(stream, lines: list[str], callback: Callable[[_OutputMessage], None] | None, error: bool) -> None:
+    for line in iter(stream.readline, ""):
+        lines.append(line)
+        if callback:
+            callback(_OutputMessage(line, error))
+    stream.close()
+
+
+class _LocalFilesystem:
+    """把沙箱内的绝对路径映射到本地根目录下，接口与 e2b 的 sandbox.files 保持一致"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _resolve(self, path: str) -> str:
+        full = os.path.realpath(os.path.join(self.root, path.lstrip("/")))
+        if full != self.root and not full.startswith(self.root + os.sep):
+            raise ValueError(f"路径超出沙箱范围: {path}")
+        return full
+
+    def read(self, path: str, format: str = "text", user: str | None = None) -> str | bytearray | Iterator[bytes]:
+        full = self._resolve(path)
+        if format == "stream":
+            return self._stream(full)
+        with open(full, "rb") as f:
+            data = f.read()
+        return data.decode("utf-8") if format == "text" else bytearray(data)
+
+    @staticmethod
+    def _stream(full: str) -> Iterator[bytes]:
+        with open(full, "rb") as f:
+            while chunk := f.read(_STREAM_CHUNK_SIZE):
+                yield chunk
+
+    def write(self, path: str, data: str | bytes, user: str | None = None) -> None:
+        full = self._resolve(path)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        with open(full, "wb") as f:
+            f.write(data.encode("utf-8") if isinstance(data, str) else data)
+
+    def write_files(self, files: list[dict], user: str | None = None) -> None:
+        for entry in files:
+            self.write(entry["path"], entry["data"], user=user)
+
+
+class _LocalCommands:
+    """在沙箱根目录下执行 shell 命令，cwd 按沙箱路径映射；命令中的绝对路径不会被映射，应使用相对 cwd 的路径"""
+
+    def __init__(self, files: _LocalFilesystem):
+        self._files = files
+
+    def run(self, cmd: str, cwd: str | None = None, timeout: float = 60, **kwargs) -> _CommandResult:
+        completed = subprocess.run(
+            ["bash", "-c", cmd], cwd=self._files._resolve(cwd or "/"),
+            capture_output=True, text=True, timeout=timeout,
+        )
+        result = _CommandResult(completed.stdout, completed.stderr, completed.returncode)
+        if result.exit_code != 0:
+            raise CommandExitError(result)
+        return result
+
+
+class LocalSandbox:
+    """
+    本地替身沙箱：每个实例拥有独立的临时根目录，代码在该目录下的独立 Python 子进程中执行。
+    只实现工具用到的 files / commands / run_code / is_running / kill，不提供真正的隔离。
+    """
+
+    def __init__(self):
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix="sandbox-"))
+        self.files = _LocalFilesystem(self.root)
+        self.commands = _LocalCommands(self.files)
+
+    def run_code(self, code: str, timeout: float = 30,
+                 on_stdout: Callable[[_OutputMessage], None] | None = None,
+                 on_stderr: Callable[[_OutputMessage], None] | None = None) -> Execution:
+        """与 e2b 的 run_code 相同，输出按行交给 on_stdout / on_stderr，同时收集到返回的 Logs 中"""
+        # 每次执行使用独立的错误文件，同一沙箱中并发的执行不会互相覆盖
+        fd, error_path = tempfile.mkstemp(prefix=".sandbox_error-", suffix=".json", dir=self.root)
+        os.close(fd)
+        try:
+            return self._run_code(code, timeout, error_path, on_stdout, on_stderr)
+        finally:
+            try:
+                os.remove(error_path)
+            except OSError:
+                # 执行期间沙箱已被销毁
+                pass
+
+    def _run_code(self, code: str, timeout: float, error_path: str,
+                  on_stdout: Callable[[_OutputMessage], None] | None,
+                  on_stderr: Callable[[_OutputMessage], None] | None) -> Execution:
+        process = subprocess.Popen(
+            # -u：不缓冲输出，回调能及时收到每一行
+            [sys.executable, "-u", "-c", _RUNNER, error_path],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=self.root,
+        )
+        stdout: list[str] = []
+        stderr: list[str] = []
+        readers = [
+            threading.Thread(target=_pump_lines, args=(process.stdout, stdout, on_stdout, False), daemon=True),
+            threading.Thread(target=_pump_lines, args=(process.stderr, stderr, on_stderr, True), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            # 子进程先读完全部代码再执行，写入不会与输出互相阻塞
+            process.stdin.write(code)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            for reader in readers:
+                reader.join()
+            return Execution(Logs(stdout, stderr), ExecutionError("TimeoutError", f"执行超过 {timeout} 秒", ""))
+        for reader in readers:
+            reader.join()
+
+        error = None
+        # 正常结束时错误文件为空
+        if os.path.exists(error_path) and os.path.getsize(error_path):
+            with open(error_path) as f:
+                error = ExecutionError(**json.load(f))
+        return Execution(Logs(stdout, stderr), error)
+
+    def is_running(self) -> bool:
+        return os.path.isdir(self.root)
+
+    def kill(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class SandboxBackend(ABC):
+    """沙箱的创建、续租、健康检查与销毁"""
+
+    @abstractmethod
+    def create(self, lease_seconds: int) -> Any:
+        """创建一个存活 lease_seconds 秒的沙箱"""
+        ...
+
+    @abstractmethod
+    def renew(self, sandbox: Any, lease_seconds: int) -> None:
+        """把沙箱的存活期限重置为 lease_seconds 秒之后，沙箱已失效时抛出异常"""
+        ...
+
+    @abstractmethod
+    def is_healthy(self, sandbox: Any) -> bool:
+        ...
+
+    @abstractmethod
+    def destroy(self, sandbox: Any) -> None:
+        ...
+
+
+class E2BBackend(SandboxBackend):
+    def create(self, lease_seconds: int) -> Any:
+        from e2b_code_interpreter import Sandbox
+
+        return Sandbox.create(timeout=lease_seconds)
+
+    def renew(self, sandbox: Any, lease_seconds: int) -> None:
+        sandbox.set_timeout(lease_seconds)
+
+    def is_healthy(self, sandbox: Any) -> bool:
+        try:
+            return sandbox.is_running()
+        except Exception:
+            return False
+
+    def destroy(self, sandbox: Any) -> None:
+        try:
+            sandbox.kill()
+        except Exception:
+            pass
+
+
+class LocalBackend(SandboxBackend):
+    def create(self, lease_seconds: int) -> LocalSandbox:
+        return LocalSandbox()
+
+    def renew(self, sandbox: LocalSandbox, lease_seconds: int) -> None:
+        if not sandbox.is_running():
+            raise RuntimeError("沙箱已失效")
+
+    def is_healthy(self, sandbox: LocalSandbox) -> bool:
+        return sandbox.is_running()
+
+    def destroy(self, sandbox: LocalSandbox) -> None:
+        sandbox.kill()
+
+
+class _Lease:
+    """池中的一个沙箱及其本地记录的远端存活期限"""
+    __slots__ = ("sandbox", "last_used", "expires_at", "in_use")
+
+    def __init__(self, sandbox: Any, lease_seconds: float):
+        self.sandbox = sandbox
+        self.last_used = time.monotonic()
+        self.expires_at = self.last_used + lease_seconds
+        # 正在进行的调用数，大于 0 时不会因闲置被回收
+        self.in_use = 0
+
+
+class SandboxPool:
+    """
+    沙箱池：
+    - 后台线程保持 min_warm 个预热沙箱，会话第一次使用时直接取用，不必等待冷启动；
+    - 会话与沙箱绑定（同一 session_id 总是拿到同一个沙箱），不同会话互不干扰；
+    - 会话的沙箱闲置超过 idle_timeout 后被销毁，状态不会泄漏给其他会话；
+      通过 use() 使用的沙箱在调用期间不算闲置，调用结束时重新开始计时；
+    - 定期检查所有沙箱的健康状态，失效的沙箱被移除，下次使用时重新分配；
+    - 沙箱总数不超过 max_size，池满时 acquire 等待其他沙箱被回收；
+    - 后台线程在存活期限到期前 renew_margin 秒续租，工具调用不再需要自己调用 set_timeout。
+      acquire 只在本地比较期限：接近到期时唤醒后台线程续租，已经过期的沙箱直接换新。
+    """
+
+    def __init__(
+        self,
+        backend: SandboxBackend,
+        min_warm: int = SANDBOX_MIN_WARM,
+        max_size: int = SANDBOX_MAX_SIZE,
+        idle_timeout: float = SANDBOX_IDLE_TIMEOUT,
+        check_interval: float = SANDBOX_CHECK_INTERVAL,
+        acquire_timeout: float = SANDBOX_ACQUIRE_TIMEOUT,
+        lease_seconds: int = SANDBOX_LEASE_SECONDS,
+        renew_margin: float = SANDBOX_RENEW_MARGIN,
+    ):
+        self.backend = backend
+        self.min_warm = min(min_warm, max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self.lease_seconds = lease_seconds
+        self.renew_margin = renew_margin
+        self._warm: deque[_Lease] = deque()
+        self._leases: dict[str, _Lease] = {}
+        self._creating = 0
+        # 正在分配沙箱的会话，避免同一会话的并发调用各自创建沙箱
+        self._allocating: set[str] = set()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._maintain_loop, name="sandbox-pool", daemon=True)
+        self._thread.start()
+
+    def _size(self) -> int:
+        return len(self._warm) + len(self._leases) + self._creating
+
+    def acquire(self, session_id: str, hold: bool = False) -> Any:
+        """
+        返回会话绑定的沙箱，没有则从预热沙箱中分配，必要时新建。
+        hold 为 True 时同时登记一次正在进行的调用，需要用 _unhold 结束，一般通过 use() 使用。
+        """
+        deadline = time.monotonic() + self.acquire_timeout
+        lapsed = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("沙箱池已关闭")
+                lease = self._leases.get(session_id)
+                if lease is not None:
+                    now = time.monotonic()
+                    if now < lease.expires_at:
+                        lease.last_used = now
+                        lease.in_use += hold
+                        if lease.expires_at - now < self.renew_margin:
+                            # 顺带触发续租，当前调用不等待
+                            self._wake.set()
+                        return lease.sandbox
+                    # 没能及时续租（例如进程被挂起），远端沙箱已经被回收，换一个新的
+                    lapsed = self._leases.pop(session_id)
+                    continue
+                if session_id in self._allocating:
+                    # 同一会话的另一个并发调用正在分配沙箱，等它完成后共用
+                    self._cond.wait()
+                    continue
+                if self._warm:
+                    warm = self._warm.popleft()
+                    break
+                if self._size() < self.max_size:
+                    warm = None
+                    self._creating += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RuntimeError(f"沙箱池已满（上限 {self.max_size} 个），等待 {self.acquire_timeout:g} 秒后仍无可用沙箱")
+                self._cond.wait(remaining)
+            self._allocating.add(session_id)
+
+        if lapsed is not None:
+            self.backend.destroy(lapsed.sandbox)
+        try:
+            lease = self._prepare(warm)
+        except BaseException:
+            with self._cond:
+                self._allocating.discard(session_id)
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            self._allocating.discard(session_id)
+            self._cond.notify_all()
+            closed = self._closed
+            if not closed:
+                lease.last_used = time.monotonic()
+                lease.in_use += hold
+                self._leases[session_id] = lease
+        if closed:
+            self.backend.destroy(lease.sandbox)
+            raise RuntimeError("沙箱池已关闭")
+        self._wake.set()
+        return lease.sandbox
+
+    def _unhold(self, session_id: str, sandbox: Any) -> None:
+        with self._cond:
+            lease = self._leases.get(session_id)
+            # 调用期间沙箱可能已失效并被替换，此时旧租约已经移除，无需处理
+            if lease is not None and lease.sandbox is sandbox:
+                lease.in_use -= 1
+                lease.last_used = time.monotonic()
+
+    @contextmanager
+    def use(self, session_id: str) -> Iterator[Any]:
+        """在 with 块内使用会话的沙箱，长时间的上传或代码执行期间沙箱不会被当作闲置回收"""
+        sandbox = self.acquire(session_id, hold=True)
+        try:
+            yield sandbox
+        finally:
+            self._unhold(session_id, sandbox)
+
+    def _prepare(self, warm: _Lease | None) -> _Lease:
+        """确认取出的预热沙箱仍然可用，失效、即将到期或没有预热沙箱时新建一个"""
+        if warm is not None:
+            if warm.expires_at - time.monotonic() > self.renew_margin and self.backend.is_healthy(warm.sandbox):
+                return warm
+            self.backend.destroy(warm.sandbox)
+            with self._cond:
+                self._creating += 1
+        try:
+            return _Lease(self.backend.create(self.lease_seconds), self.lease_seconds)
+        finally:
+            with self._cond:
+                self._creating -= 1
+                self._cond.notify_all()
+
+    def release(self, session_id: str) -> None:
+        """会话结束时销毁它的沙箱"""
+        with self._cond:
+            lease = self._leases.pop(session_id, None)
+            self._cond.notify_all()
+        if lease is not None:
+            self.backend.destroy(lease.sandbox)
+            self._wake.set()
+
+    def invalidate(self, session_id: str, sandbox: Any) -> bool:
+        """
+        工具调用失败时检查会话的沙箱是否已经失效。
+        已失效则移除并销毁，返回 True，调用方可以重新 acquire 得到新沙箱后重试；沙箱正常则返回 False。
+        """
+        if self.backend.is_healthy(sandbox):
+            return False
+        with self._cond:
+            lease = self._leases.get(session_id)
+            if lease is not None and lease.sandbox is sandbox:
+                del self._leases[session_id]
+                self._cond.notify_all()
+        self.backend.destroy(sandbox)
+        self._wake.set()
+        return True
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            return {"warm": len(self._warm), "leased": len(self._leases), "creating": self._creating}
+
+    def _maintain_loop(self) -> None:
+        while not self._closed:
+            self._wake.clear()
+            try:
+                self._evict_idle()
+                renewed = self._renew_leases()
+                self._check_health(renewed)
+                self._refill()
+            except Exception:
+                # 后台维护失败不影响前台调用，下个周期重试
+                pass
+            self._wake.wait(self.check_interval)
+
+    def _evict_idle(self) -> None:
+        now = time.monotonic()
+        with self._cond:
+            expired = [sid for sid, lease in self._leases.items()
+                       if not lease.in_use and now - lease.last_used > self.idle_timeout]
+            evicted = [self._leases.pop(sid).sandbox for sid in expired]
+            if evicted:
+                self._cond.notify_all()
+        for sandbox in evicted:
+            self.backend.destroy(sandbox)
+
+    def _renew_leases(self) -> set[int]:
+        """为即将到期的沙箱续租，续租失败说明沙箱已失效，直接移除；返回本轮续租成功的沙箱 id"""
+        now = time.monotonic()
+        with self._cond:
+            due = [lease for lease in [*self._warm, *self._leases.values()]
+                   if lease.expires_at - now < self.renew_margin]
+
+        renewed, dead = set(), []
+        for lease in due:
+            try:
+                self.backend.renew(lease.sandbox, self.lease_seconds)
+            except Exception:
+                dead.append(lease)
+                continue
+            lease.expires_at = time.monotonic() + self.lease_seconds
+            renewed.add(id(lease))
+        self._remove_dead(dead)
+        return renewed
+
+    def _check_health(self, skip: set[int]) -> None:
+        with self._cond:
+            leases = [lease for lease in [*self._warm, *self._leases.values()] if id(lease) not in skip]
+        self._remove_dead([lease for lease in leases if not self.backend.is_healthy(lease.sandbox)])
+
+    def _remove_dead(self, dead: list[_Lease]) -> None:
+        if not dead:
+            return
+        with self._cond:
+            # 只移除检查时的那个租约，期间被替换的不受影响
+            for lease in dead:
+                if lease in self._warm:
+                    self._warm.remove(lease)
+            for sid in [sid for sid, lease in self._leases.items() if lease in dead]:
+                del self._leases[sid]
+            self._cond.notify_all()
+        for lease in dead:
+            self.backend.destroy(lease.sandbox)
+
+    def _refill(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed or len(self._warm) + self._creating >= self.min_warm or self._size() >= self.max_size:
+                    return
+                self._creating += 1
+            try:
+                lease = _Lease(self.backend.create(self.lease_seconds), self.lease_seconds)
+            except Exception:
+                with self._cond:
+                    self._creating -= 1
+                    self._cond.notify_all()
+                raise
+            with self._cond:
+                self._creating -= 1
+                self._warm.append(lease)
+                self._cond.notify_all()
+
+    def shutdown(self) -> None:
+        """销毁池中的所有沙箱"""
+        with self._cond:
+            self._closed = True
+            sandboxes = [lease.sandbox for lease in [*self._warm, *self._leases.values()]]
+            self._warm.clear()
+            self._leases.clear()
+            self._cond.notify_all()
+        self._wake.set()
+        for sandbox in sandboxes:
+            self.backend.destroy(sandbox)
+
+
+_pool: SandboxPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool() -> SandboxPool:
+    """按环境变量 SANDBOX_BACKEND 创建全局共享的沙箱池，进程退出时销毁所有沙箱"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if SANDBOX_BACKEND == "e2b":
+                backend = E2BBackend()
+            elif SANDBOX_BACKEND == "local":
+                backend = LocalBackend()
+            else:
+                raise ValueError(f"未知的 SANDBOX_BACKEND: {SANDBOX_BACKEND}，可选值: e2b, local")
+            _pool = SandboxPool(backend)
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -0,0 +1,11 @@
+from langchain.tools import ToolRuntime
+
+# 没有 thread_id 时（例如直接调用工具）所有调用共用这个会话
+DEFAULT_SESSION_ID = "default"
+
+
+def session_id_of(runtime: ToolRuntime | None) -> str:
+    """从工具运行时的配置中取出会话 ID（LangGraph 的 thread_id），不同会话的计划、沙箱互相独立"""
+    config = getattr(runtime, "config", None) or {}
+    thread_id = config.get("configurable", {}).get("thread_id")
+    return str(thread_id) if thread_id else DEFAULT_SESSION_ID
@@ -0,0 +1,228 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterator
+
+# 正则解析器是标准库的内部模块，不同 Python 版本位置不同（3.11 起为 re._parser），也可能被移除；
+# 拿不到时无法提取字面量，查询退化为全量逐文件校验
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    try:
+        import sre_parse
+    except ImportError:
+        sre_parse = None
+
+from .file_cache import file_cache
+from .fs_walk import iter_tree
+
+# 超过这个大小的文件不建索引（通常是数据或生成文件）
+MAX_INDEXED_FILE_BYTES = 1024 * 1024
+# 两次增量刷新之间的最小间隔（秒），避免连续查询时反复遍历目录
+_REFRESH_INTERVAL = 2.0
+# 最多同时常驻多少个目录的索引，以及所有索引倒排表条目（三元组, 文件）的总数上限，超出后按 LRU 淘汰
+MAX_INDEXES = 8
+MAX_INDEX_POSTINGS = 4_000_000
+
+Match = tuple[str, int, str]
+
+
+def _trigrams(data: bytes) -> set[bytes]:
+    return {data[i:i + 3] for i in range(len(data) - 2)}
+
+
+def required_literals(query: str) -> list[bytes]:
+    """
+    从正则表达式中提取所有匹配都必须包含的字面量片段（UTF-8 编码，ASCII 转小写）。
+
+    只分析最外层的连续字面量，遇到分支、可选、重复等结构就截断，
+    宁可少提取也不能漏掉真正的匹配。解析失败时返回空列表，表示无法剪枝。
+    """
+    if sre_parse is None:
+        return []
+
+    literals: list[bytes] = []
+    run: list[str] = []
+    # 内部解析器的接口没有稳定性保证，任何异常都按无法解析处理
+    try:
+        for op, arg in sre_parse.parse(query):
+            if op is sre_parse.LITERAL:
+                run.append(chr(arg))
+                continue
+            if len(run) >= 3:
+                literals.append("".join(run).encode("utf-8").lower())
+            run = []
+    except Exception:
+        return []
+    if len(run) >= 3:
+        literals.append("".join(run).encode("utf-8").lower())
+    return literals
+
+
+def compile_query(query: str) -> re.Pattern:
+    """与 rg 一致把查询当作正则；无法编译时退化为普通字符串匹配"""
+    try:
+        return re.compile(query)
+    except re.error:
+        return re.compile(re.escape(query))
+
+
+def _is_binary(data: bytes) -> bool:
+    return b"\0" in data[:8192]
+
+
+def scan_file(path: str, pattern: re.Pattern) -> Iterator[Match]:
+    """逐行用 pattern 校验一个文件，产出 (路径, 行号, 内容)"""
+    try:
+        data = file_cache.read_bytes(path)
+    except OSError:
+        return
+    if _is_binary(data):
+        return
+    lines = data.decode("utf-8", errors="replace").split("\n")
+    # 以换行符结尾的文件最后会多出一个空串，不算作一行
+    if lines and not lines[-1]:
+        lines.pop()
+    for ln, line in enumerate(lines, 1):
+        if pattern.search(line):
+            yield path, ln, line.rstrip("\r")
+
+
+class TrigramIndex:
+    """
+    工作区的三元组（trigram）倒排索引。
+
+    - 第一次查询时遍历整个目录（遵循 .gitignore）建立索引；
+    - 之后每次查询前按 (mtime, size) 增量刷新，只重新读取变化的文件；
+    - 查询时先用查询中必需的字面量求交集得到候选文件，再逐行校验正则。
+
+    文件内容统一把 ASCII 字母转小写后建索引，因此同时适用于区分与不区分大小写的查询。
+    文件变化时分配新的文件 ID，旧 ID 标记为失效，失效过多时整体重建。
+    """
+
+    def __init__(self, root: str, max_file_bytes: int = MAX_INDEXED_FILE_BYTES):
+        self.root = root
+        self.max_file_bytes = max_file_bytes
+        self._files: dict[str, tuple[int, int, int]] = {}  # 相对路径 -> (文件 ID, mtime_ns, size)
+        self._paths: list[str | None] = []  # 文件 ID -> 相对路径，None 表示已失效
+        self._postings: dict[bytes, set[int]] = {}
+        self._dead = 0
+        self._last_refresh = 0.0
+        self._lock = threading.Lock()
+        # 倒排表中 (三元组, 文件 ID) 条目的数量，用于估算索引占用的内存
+        self.postings_count = 0
+
+    def _add_file(self, rel_path: str, full_path: str, mtime_ns: int, size: int) -> None:
+        file_id = len(self._paths)
+        self._paths.append(rel_path)
+        self._files[rel_path] = (file_id, mtime_ns, size)
+        if size > self.max_file_bytes:
+            return
+        # 建索引时直接读盘，不占用共享读缓存
+        try:
+            with open(full_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        if _is_binary(data):
+            return
+        grams = _trigrams(data.lower())
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(file_id)
+        self.postings_count += len(grams)
+
+    def _discard_file(self, rel_path: str) -> None:
+        file_id, _, _ = self._files.pop(rel_path)
+        self._paths[file_id] = None
+        self._dead += 1
+
+    def refresh(self, force: bool = False) -> None:
+        """按 mtime / size 增量更新索引"""
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < _REFRESH_INTERVAL:
+                return
+
+            # 失效条目超过一半时整体重建，回收倒排表中的无用 ID
+            if self._dead > len(self._files):
+                self._files.clear()
+                self._paths.clear()
+                self._postings.clear()
+                self._dead = 0
+                self.postings_count = 0
+
+            seen = set()
+            for item in iter_tree(self.root):
+                if item.is_dir:
+                    continue
+                try:
+                    st = item.entry.stat()
+                except OSError:
+                    continue
+                seen.add(item.path)
+                known = self._files.get(item.path)
+                if known and known[1:] == (st.st_mtime_ns, st.st_size):
+                    continue
+                if known:
+                    self._discard_file(item.path)
+                self._add_file(item.path, item.entry.path, st.st_mtime_ns, st.st_size)
+
+            for rel_path in [p for p in self._files if p not in seen]:
+                self._discard_file(rel_path)
+
+            self._last_refresh = time.monotonic()
+
+    def candidates(self, query: str) -> list[str]:
+        """返回可能包含匹配的文件（相对路径，已排序）"""
+        grams: set[bytes] = set()
+        for literal in required_literals(query):
+            grams |= _trigrams(literal)
+
+        with self._lock:
+            if grams:
+                postings = sorted((self._postings.get(g, set()) for g in grams), key=len)
+                ids = set(postings[0]).intersection(*postings[1:])
+                # 超过大小上限未建索引的文件无法剪枝，始终作为候选
+                paths = [self._paths[i] for i in ids]
+                paths += [p for p, (_, _, size) in self._files.items() if size > self.max_file_bytes]
+            else:
+                paths = list(self._files)
+        return sorted({p for p in paths if p is not None})
+
+    def search(self, query: str) -> Iterator[Match]:
+        """按路径 + 行号顺序产出匹配，调用方可以随时停止迭代"""
+        self.refresh()
+        pattern = compile_query(query)
+        for rel_path in self.candidates(query):
+            yield from scan_file(os.path.join(self.root, rel_path), pattern)
+
+
+_indexes: OrderedDict[str, TrigramIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(root: str) -> TrigramIndex:
+    """
+    每个目录共享一份索引。索引数量或倒排表总条目数超出上限时，
+    淘汰最久未使用的索引（当前请求的索引除外），之后再查询该目录时重新建立。
+    """
+    key = os.path.abspath(root)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = TrigramIndex(root)
+        _indexes.move_to_end(key)
+        total = sum(i.postings_count for i in _indexes.values())
+        while len(_indexes) > 1 and (len(_indexes) > MAX_INDEXES or total > MAX_INDEX_POSTINGS):
+            _, evicted = _indexes.popitem(last=False)
+            total -= evicted.postings_count
+    return index
+
+
+def iter_indexed_matches(query: str, file_path: str) -> Iterator[Match]:
+    """不依赖 rg 的搜索：目录走三元组索引，单个文件直接逐行校验"""
+    if os.path.isdir(file_path):
+        yield from get_index(file_path).search(query)
+    else:
+        yield from scan_file(file_path, compile_query(query))
@@ -1,12 +1,13 @@
 import os
 
 from dotenv import load_dotenv
-from langchain.tools import tool
+from langchain.tools import ToolRuntime, tool
 from langchain_community.document_loaders import BrowserlessLoader
 from langchain_community.utilities import GoogleSerperAPIWrapper
 from langchain_core.documents import Document
 
-from .e2b import get_sandbox
+from .e2b import run_in_sandbox
+from .session import session_id_of
 
 load_dotenv()
 
@@ -27,12 +28,19 @@ def google_search(query: str) -> dict:
     return search.results(query)
 
 
+async def _agoogle_search(query: str) -> dict:
+    """google_search 的原生异步实现"""
+    return await search.aresults(query)
+
+
+google_search.coroutine = _agoogle_search
 
 
 @tool
 def browserless_web_loader(
     urls: list[str],
     file_paths: list[str],
+    runtime: ToolRuntime,
     text_content: bool = True,
 ) -> list[dict]:
     """
@@ -72,16 +80,9 @@ def browserless_web_loader(
             })
 
         try:
-            sbx = get_sandbox()
-            sbx.set_timeout(600)
-
-            for item in results:
-                sbx.files.write_files([
-                    {
-                        "path": item["path"], 
-                        "data": item["content"]
-                    }
-                ])
+            # 一次请求写入所有网页内容
+            entries = [{"path": item["path"], "data": item["content"]} for item in results]
+            run_in_sandbox(session_id_of(runtime), lambda sbx: sbx.files.write_files(entries))
         except Exception as e:
             raise Exception(f"写入文件时出错: {e}")
         return results